@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+
+"""
+Measure time to fold a long single-line example.
+
+  $ python -m benchmark.fold [size_in_bytes] [max_width]
+"""
+
+import sys
+import time
+
+from shakyo import consolekit as ck
+
+
+
+# constants
+
+_DEFAULT_SIZE = 10 * 1024 * 1024
+_DEFAULT_MAX_WIDTH = 79
+_PATTERN = "function(a,b){return a\t+b;}var s='漢字';"
+
+
+
+# functions
+
+def _make_line(size):
+  string = _PATTERN * (size // len(_PATTERN.encode("UTF-8")))
+  return ck.Line.from_string(string, [0] * len(string))
+
+
+def main():
+  size = int(sys.argv[1]) if len(sys.argv) > 1 else _DEFAULT_SIZE
+  max_width = int(sys.argv[2]) if len(sys.argv) > 2 else _DEFAULT_MAX_WIDTH
+
+  line = _make_line(size)
+  start_time = time.perf_counter()
+  column_offsets = line.column_offsets
+  middle_time = time.perf_counter()
+  number_of_lines = sum(1 for _ in line.fold(max_width))
+  end_time = time.perf_counter()
+
+  print("characters: {}".format(len(line)))
+  print("width: {}".format(column_offsets[-1]))
+  print("folded lines: {}".format(number_of_lines))
+  print("normalization: {:.2f} s".format(middle_time - start_time))
+  print("folding: {:.2f} s".format(end_time - middle_time))
+
+
+if __name__ == "__main__":
+  main()
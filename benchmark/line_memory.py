@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+"""
+Compare memory consumption of the compact Line layout against the previous
+layout which kept one Character object per glyph.
+
+  $ python -m benchmark.line_memory [path]
+"""
+
+import sys
+import tracemalloc
+
+from shakyo import consolekit as ck
+
+
+
+# constants
+
+_DEFAULT_LINE = "for (var i = 0; i < array.length; i++) { sum += array[i]; }"
+_DEFAULT_NUMBER_OF_LINES = 20000
+
+
+
+# classes
+
+class _ObjectPerCharLine:
+  """
+  The previous layout of Line, a tuple of Character objects.
+  """
+
+  def __init__(self, *chars):
+    self._chars = chars
+
+
+
+# functions
+
+def _measure(make_line, text_lines):
+  tracemalloc.start()
+  lines = [make_line(text_line) for text_line in text_lines]
+  size, _ = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  return size, sum(len(text_line) for text_line in text_lines)
+
+
+def _report(name, size, number_of_chars):
+  print("{:>16}: {:>12} bytes ({:.1f} bytes/char)"
+        .format(name, size, size / max(number_of_chars, 1)))
+
+
+def _read_text_lines(argv):
+  if len(argv) > 1:
+    with open(argv[1], encoding="UTF-8", errors="replace") as f:
+      return [line.rstrip() for line in f]
+  return [_DEFAULT_LINE] * _DEFAULT_NUMBER_OF_LINES
+
+
+def main():
+  text_lines = _read_text_lines(sys.argv)
+  _report("object-per-char",
+          *_measure(lambda text_line: _ObjectPerCharLine(
+                        *(ck.Character(char) for char in text_line
+                          if ck.is_printable_char(char))),
+                    text_lines))
+  _report("compact",
+          *_measure(lambda text_line: ck.Line(
+                        *(ck.Character(char) for char in text_line
+                          if ck.is_printable_char(char))),
+                    text_lines))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+"""
+Compare bytes written to a terminal and time per frame between the curses
+console and the truecolor console.
+Each frame scrolls an example by one line and types some characters on
+it, which is what happens while typing an example.
+
+  $ python -m benchmark.render [example_path] [number_of_frames]
+"""
+
+import fcntl
+import json
+import os
+import os.path
+import pty
+import select
+import statistics
+import struct
+import sys
+import termios
+import time
+
+from shakyo import consolekit as ck
+from shakyo import pygments_util
+from shakyo import source
+from shakyo import text_to_lines
+
+
+
+# constants
+
+_DEFAULT_EXAMPLE_PATH = os.path.join(os.path.dirname(__file__),
+                                     "..", "shakyo", "shakyo.py")
+_DEFAULT_NUMBER_OF_FRAMES = 1000
+_SCREEN_HEIGHT = 40
+_SCREEN_WIDTH = 120
+_CONSOLE_CLASSES = [ck.Console, ck.TruecolorConsole]
+
+
+
+# functions
+
+def _render(console_class, example_path, number_of_frames):
+  example_source = source.FileSource(example_path)
+  with console_class() as console:
+    lexer = pygments_util.guess_lexer(filename=example_path,
+                                      text=example_source.head(8 * 1024))
+    lines = [folded_line
+             for _, line in text_to_lines.text_to_lines(example_source,
+                                                        console,
+                                                        lexer)
+             for folded_line in line.fold(console.screen_width - 1)]
+    y_input = console.screen_height // 2
+
+    for y in range(console.screen_height):
+      console.print_line(y, lines[y % len(lines)])
+    console.refresh()
+
+    frame_times = []
+    for index in range(number_of_frames):
+      start_time = time.perf_counter()
+      console.scroll(lines[(index + console.screen_height) % len(lines)])
+      example_line = lines[(index + y_input + 1) % len(lines)]
+      console.print_line(y_input, example_line)
+      console.print_line(y_input,
+                         example_line[:index % (len(example_line) + 1)],
+                         clear=False)
+      console.refresh()
+      frame_times.append(time.perf_counter() - start_time)
+  return frame_times
+
+
+def _measure(console_class, example_path, number_of_frames):
+  """
+  Render frames in a pseudo terminal and return the number of bytes written
+  to it and the times taken by frames.
+  """
+  read_fd, write_fd = os.pipe()
+  pid, terminal_fd = pty.fork()
+  if pid == 0:
+    os.close(read_fd)
+    os.environ["TERM"] = "xterm-256color"
+    frame_times = _render(console_class, example_path, number_of_frames)
+    os.write(write_fd, json.dumps(frame_times).encode())
+    os._exit(0)
+
+  os.close(write_fd)
+  fcntl.ioctl(terminal_fd,
+              termios.TIOCSWINSZ,
+              struct.pack("HHHH", _SCREEN_HEIGHT, _SCREEN_WIDTH, 0, 0))
+
+  number_of_bytes = 0
+  result = b""
+  fds = [terminal_fd, read_fd]
+  while read_fd in fds:
+    for fd in select.select(fds, [], [])[0]:
+      try:
+        data = os.read(fd, 64 * 1024)
+      except OSError:
+        data = b""
+      if fd == terminal_fd:
+        number_of_bytes += len(data)
+      else:
+        result += data
+      if len(data) == 0:
+        fds.remove(fd)
+  os.waitpid(pid, 0)
+  return number_of_bytes, json.loads(result.decode())
+
+
+def main():
+  example_path = sys.argv[1] if len(sys.argv) > 1 else _DEFAULT_EXAMPLE_PATH
+  number_of_frames = int(sys.argv[2]) if len(sys.argv) > 2 \
+                     else _DEFAULT_NUMBER_OF_FRAMES
+
+  for console_class in _CONSOLE_CLASSES:
+    number_of_bytes, frame_times = _measure(console_class,
+                                            example_path,
+                                            number_of_frames)
+    print("{:>16}: {:>10} bytes ({:.1f} bytes/frame), "
+          "{:.3f} ms/frame (median), {:.3f} ms/frame (max)"
+          .format(console_class.__name__,
+                  number_of_bytes,
+                  number_of_bytes / number_of_frames,
+                  statistics.median(frame_times) * 1000,
+                  max(frame_times) * 1000))
+
+
+if __name__ == "__main__":
+  main()
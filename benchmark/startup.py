@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+"""
+Measure cold startup time of shakyo with `python -X importtime` and check
+it against budgets in milliseconds.
+
+  $ python -m benchmark.startup [version_budget] [open_budget]
+
+The "version" case runs `shakyo --version` and the "open" case does
+everything to open a small file before a console is initialized.
+It exits with status 1 when any of them is over its budget.
+"""
+
+import os.path
+import re
+import statistics
+import subprocess
+import sys
+
+
+
+# constants
+
+_DEFAULT_VERSION_BUDGET = 200
+_DEFAULT_OPEN_BUDGET = 400
+_NUMBER_OF_RUNS = 5
+_NUMBER_OF_SLOWEST_IMPORTS = 5
+_SMALL_FILE = os.path.join(os.path.dirname(__file__), "..", "shakyo", "log.py")
+_OPEN_CODE = """
+import sys
+from shakyo import path_to_x, pygments_util
+source = path_to_x.path_to_source(sys.argv[1])
+text = source.head(8 * 1024)
+lexer = pygments_util.guess_lexer(
+    filename=path_to_x.path_to_filename(sys.argv[1]), text=text)
+for _ in lexer.get_tokens(text): pass
+"""
+_IMPORT_TIME_PATTERN = re.compile(
+    r"^import time:\s*(\d+) \|\s*(\d+) \|( *)(\S+)$")
+
+
+
+# functions
+
+def _import_times(args):
+  """
+  Run a Python process and return cumulative import times in microseconds
+  of its top-level modules and self import times of all modules.
+  """
+  process = subprocess.run([sys.executable, "-X", "importtime"] + args,
+                           stdout=subprocess.DEVNULL,
+                           stderr=subprocess.PIPE,
+                           universal_newlines=True,
+                           check=True)
+  top_level_times = {}
+  self_times = {}
+  for line in process.stderr.splitlines():
+    match = _IMPORT_TIME_PATTERN.match(line)
+    if match is None:
+      continue
+    self_time, cumulative_time, indent, module = match.groups()
+    self_times[module] = int(self_time)
+    if len(indent) == 1:
+      top_level_times[module] = int(cumulative_time)
+  return top_level_times, self_times
+
+
+def _measure(name, args, budget):
+  _import_times(args) # warm up caches of Python and shakyo
+
+  totals = []
+  for _ in range(_NUMBER_OF_RUNS):
+    top_level_times, self_times = _import_times(args)
+    totals.append(sum(top_level_times.values()) / 1000)
+
+  total = statistics.median(totals)
+  print("{:>8}: {:8.1f} ms of imports (budget: {} ms)"
+        .format(name, total, budget))
+  for module, time in sorted(self_times.items(),
+                             key=lambda item: item[1],
+                             reverse=True)[:_NUMBER_OF_SLOWEST_IMPORTS]:
+    print("{:>12.1f} ms  {}".format(time / 1000, module))
+  return total <= budget
+
+
+def main():
+  version_budget = int(sys.argv[1]) if len(sys.argv) > 1 \
+                   else _DEFAULT_VERSION_BUDGET
+  open_budget = int(sys.argv[2]) if len(sys.argv) > 2 \
+                else _DEFAULT_OPEN_BUDGET
+
+  results = [_measure("version", ["-m", "shakyo", "--version"], version_budget),
+             _measure("open", ["-c", _OPEN_CODE, _SMALL_FILE], open_budget)]
+  exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+  main()
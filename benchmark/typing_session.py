@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+
+"""
+Replay typing sessions on a headless console and report keystrokes per
+second, percentiles of latency per key or paste and peak memory usage.
+
+  $ python -m benchmark.typing_session [session.json ...]
+
+Without arguments, sessions are made up on small, huge, wide-Unicode and
+tab-heavy examples, lines of the small one are also pasted, and lines of
+the huge one are gone to and searched for. A recorded
+session is a JSON object like
+{"name": ..., "example_path": ..., "keys": [...]}, where keys are strings
+of characters typed at once or pairs of a height and a width of a resized
+screen.
+Each session is run in its own process with an empty cache directory.
+"""
+
+import curses.ascii
+import json
+import os
+import os.path
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from shakyo import config
+from shakyo import consolekit as ck
+from shakyo import example_files
+from shakyo import shakyo
+from shakyo import source
+
+
+
+# constants
+
+_SMALL_EXAMPLE_PATH = os.path.join(os.path.dirname(__file__),
+                                   "..", "shakyo", "shakyo.py")
+_NUMBER_OF_HUGE_EXAMPLE_LINES = 200000
+_NUMBER_OF_GENERATED_LINES = 2000
+_NUMBER_OF_TYPED_LINES = 200
+_TYPO_RATE = 0.05
+_SCREEN_HEIGHT = 40
+_SCREEN_WIDTH = 100
+_NUMBER_OF_RESIZES = 10
+_NUMBER_OF_JUMPS = 50
+_PERCENTILES = [50, 90, 99, 100]
+_RUN_OPTION = "--run"
+
+
+
+# functions
+
+def _generate_examples(directory):
+  """
+  Write examples to a directory and return paths to them by their names.
+  """
+  words = ["def", "return", "self", "index", "value", "(", ")", ":", "=",
+           "+", "lines", "0", "1"]
+  wide_words = ["漢字", "かな", "カタカナ", "混じり", "文", "한국어", "全角",
+                "ＡＢＣ", "、", "。"]
+  generator = random.Random(0)
+
+  def make_lines(number_of_lines, make_line):
+    return "\n".join(make_line(index) for index in range(number_of_lines))
+
+  examples = {
+    "huge.py" : make_lines(
+        _NUMBER_OF_HUGE_EXAMPLE_LINES,
+        lambda index: "  " * (index % 4)
+                      + " ".join(generator.choice(words) for _ in range(8))),
+    "wide.txt" : make_lines(
+        _NUMBER_OF_GENERATED_LINES,
+        lambda index: "".join(generator.choice(wide_words)
+                              for _ in range(index % 12 + 1))),
+    "tabs.c" : make_lines(
+        _NUMBER_OF_GENERATED_LINES,
+        lambda index: "\t" * (index % 6)
+                      + "\t".join(generator.choice(words) for _ in range(4))),
+  }
+
+  paths = {"small" : os.path.abspath(_SMALL_EXAMPLE_PATH)}
+  for filename, text in examples.items():
+    paths[os.path.splitext(filename)[0]] = os.path.join(directory, filename)
+    with open(paths[os.path.splitext(filename)[0]], "w") as f:
+      f.write(text)
+  return paths
+
+
+def _make_keys(example_path, number_of_pages=0, paste=False):
+  """
+  Make keys to type the first lines of an example with some typos fixed
+  immediately, to go down and up pages, and then to resize a screen.
+  Lines are pasted without typos if paste is True.
+  """
+  generator = random.Random(0)
+  keys = []
+
+  with open(example_path) as f:
+    text_lines = f.read().strip("\n").split("\n")[:_NUMBER_OF_TYPED_LINES]
+  for text_line in text_lines:
+    if paste:
+      keys.append(text_line.rstrip() + "\n")
+      continue
+    for char in text_line.rstrip():
+      if generator.random() < _TYPO_RATE:
+        keys.extend(["#", chr(curses.ascii.DEL)])
+      keys.append(char)
+    keys.append("\n")
+
+  keys.extend([config.PAGE_DOWN_CHAR] * number_of_pages)
+  keys.extend([config.PAGE_UP_CHAR] * (number_of_pages // 2))
+  for index in range(_NUMBER_OF_RESIZES):
+    keys.append([_SCREEN_HEIGHT // 2, _SCREEN_WIDTH // 2] if index % 2 == 0
+                else [_SCREEN_HEIGHT, _SCREEN_WIDTH])
+  return keys
+
+
+def _make_jump_keys(number_of_lines):
+  """
+  Make keys to go to random lines of an example and type a few characters
+  there, and to search for words incrementally.
+  """
+  generator = random.Random(0)
+  keys = []
+  for _ in range(_NUMBER_OF_JUMPS):
+    keys.extend([config.GOTO_LINE_CHAR,
+                 str(generator.randint(1, number_of_lines)),
+                 "\n",
+                 " ",
+                 chr(curses.ascii.DEL)])
+  for word in ["index", "value", "lines"]:
+    keys.append(config.SEARCH_CHAR)
+    keys.extend(word)
+    keys.extend([config.SEARCH_CHAR] * 3 + ["\n"])
+  return keys
+
+
+def _make_sessions(directory):
+  paths = _generate_examples(directory)
+  return [{"name" : name,
+           "example_path" : paths[name],
+           "keys" : _make_keys(paths[name],
+                               number_of_pages=(
+                                   1000 if name == "huge" else 20))}
+          for name in ["small", "huge", "wide", "tabs"]] \
+         + [{"name" : "paste",
+             "example_path" : paths["small"],
+             "keys" : _make_keys(paths["small"], paste=True)},
+            {"name" : "jump",
+             "example_path" : paths["huge"],
+             "keys" : _make_jump_keys(_NUMBER_OF_HUGE_EXAMPLE_LINES)}]
+
+
+def _run_session(session):
+  """
+  Type keys of a session on a headless console and return its statistics.
+  """
+  latencies = []
+
+  number_of_keystrokes = 0
+
+  def keys():
+    nonlocal number_of_keystrokes
+    for key in session["keys"]:
+      start_time = time.perf_counter()
+      yield key
+      latencies.append(time.perf_counter() - start_time)
+      number_of_keystrokes += len(key) if isinstance(key, str) else 1
+
+  start_time = time.perf_counter()
+  example_source = source.FileSource(session["example_path"])
+  with example_files.ExampleFiles([session["example_path"]],
+                                  [example_source]) as examples, \
+       ck.HeadlessConsole(keys(),
+                          screen_height=_SCREEN_HEIGHT,
+                          screen_width=_SCREEN_WIDTH) as console:
+    shakyo.Shakyo(console,
+                  examples.example_lines(console,
+                                         style_name="default",
+                                         colorize=True,
+                                         decorate=True),
+                  examples=examples).do()
+  total_time = time.perf_counter() - start_time
+
+  latencies.sort()
+  return {
+    "name" : session["name"],
+    "keystrokes" : number_of_keystrokes,
+    "seconds" : total_time,
+    "latencies" : [latencies[min(len(latencies) * percentile // 100,
+                                 len(latencies) - 1)]
+                   for percentile in _PERCENTILES] if latencies else [],
+    "max_rss" : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+  }
+
+
+def _run_session_in_process(session, cache_directory):
+  environment = dict(os.environ, XDG_CACHE_HOME=cache_directory)
+  output = subprocess.check_output(
+      [sys.executable, "-m", "benchmark.typing_session", _RUN_OPTION,
+       json.dumps(session)],
+      env=environment,
+      cwd=os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+  return json.loads(output.decode())
+
+
+def _report(result):
+  print("{:>8}: {:>7} keys, {:>9.1f} keys/s, latency {} ms, "
+        "peak RSS {:.1f} MiB"
+        .format(result["name"],
+                result["keystrokes"],
+                result["keystrokes"] / result["seconds"],
+                " / ".join("p{} {:.3f}".format(percentile, latency * 1000)
+                           for percentile, latency
+                           in zip(_PERCENTILES, result["latencies"])),
+                result["max_rss"] / 1024))
+
+
+def main():
+  if len(sys.argv) == 3 and sys.argv[1] == _RUN_OPTION:
+    print(json.dumps(_run_session(json.loads(sys.argv[2]))))
+    return
+
+  with tempfile.TemporaryDirectory() as directory:
+    if len(sys.argv) > 1:
+      sessions = []
+      for path in sys.argv[1:]:
+        with open(path) as f:
+          sessions.append(json.load(f))
+    else:
+      sessions = _make_sessions(directory)
+
+    for index, session in enumerate(sessions):
+      _report(_run_session_in_process(
+          session,
+          os.path.join(directory, "cache{}".format(index))))
+
+
+if __name__ == "__main__":
+  main()
@@ -1,55 +1,72 @@
 #!/usr/bin/env python
 
+import contextlib
+import cProfile
 import sys
 
 from . import consolekit as ck
 from .get_args import get_args
-from .path_to_x import path_to_filename, path_to_text
-from . import pygments_util
+from .path_to_x import expand_paths, path_to_source
+from . import example_files
+from . import latency_tracer
 from . import shakyo
-from . import text_to_lines
 from . import log
 
 
 
-def get_example_lines(example_path,
-                      example_text,
-                      console,
-                      *,
-                      lexer_name,
-                      style_name,
-                      colorize,
-                      decorate):
-  return text_to_lines.text_to_lines(
-      example_text,
-      console,
-      lexer=pygments_util.guess_lexer(
-          lexer_name=lexer_name,
-          filename=path_to_filename(example_path),
-          text=example_text),
-      style_name=style_name,
-      colorize=colorize,
-      decorate=decorate)
-
+# functions
 
 def main():
   args = get_args()
 
   if not sys.stdout.isatty(): log.error("stdout is not a tty.")
 
-  example_text = path_to_text(args.example_path)
-
-  with ck.Console(asciize=args.asciize,
-                  spaces_per_tab=args.spaces_per_tab,
-                  background_rgb=args.background_rgb) as console:
-    shakyo.Shakyo(console,
-                  get_example_lines(args.example_path,
-                                    example_text,
-                                    console,
-                                    lexer_name=args.lexer_name,
-                                    style_name=args.style_name,
-                                    colorize=args.colorize,
-                                    decorate=args.decorate)).do()
+  example_paths = expand_paths(args.example_paths)
+  example_sources = [path_to_source(path) for path in example_paths]
+
+  console_class = ck.TruecolorConsole if ck.is_truecolor_terminal() \
+                  else ck.Console
+  tracer = latency_tracer.LatencyTracer() \
+           if args.trace_latency or args.trace_file is not None else None
+  profiler = cProfile.Profile() if args.profile_file is not None else None
+
+  with example_files.ExampleFiles(example_paths,
+                                  example_sources,
+                                  lexer_name=args.lexer_name) as examples, \
+       console_class(asciize=args.asciize,
+                     spaces_per_tab=args.spaces_per_tab,
+                     background_rgb=args.background_rgb,
+                     perceptual_colors=args.perceptual_colors) as console:
+    session = shakyo.Shakyo(console,
+                            examples.example_lines(
+                                console,
+                                style_name=args.style_name,
+                                colorize=args.colorize,
+                                decorate=args.decorate),
+                            tracer=tracer,
+                            max_fps=args.max_fps,
+                            examples=examples,
+                            resume=args.resume)
+    try:
+      if profiler is None:
+        session.do()
+      else:
+        profiler.runcall(session.do)
+    except KeyboardInterrupt:
+      # A session can be interrupted in the middle of an update of its
+      # position, which is saved only if it is available.
+      with contextlib.suppress(Exception):
+        examples.save_session(session.position)
+      raise
+    examples.save_session(session.position)
+
+  # Results are written after the console is turned off not to break it.
+  if tracer is not None:
+    tracer.write_summary(sys.stderr)
+    if args.trace_file is not None:
+      tracer.write_chrome_trace(args.trace_file)
+  if profiler is not None:
+    profiler.dump_stats(args.profile_file)
 
 
 if __name__ == "__main__":
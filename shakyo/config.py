@@ -8,6 +8,12 @@ from . import consolekit as ck
 VERSION = "0.0.10"
 
 COMMAND_NAME = os.path.basename(sys.argv[0])
+CACHE_DIRECTORY = os.path.join(os.environ.get("XDG_CACHE_HOME")
+                               or os.path.expanduser("~/.cache"),
+                               "shakyo")
+STATE_DIRECTORY = os.path.join(os.environ.get("XDG_STATE_HOME")
+                               or os.path.expanduser("~/.local/state"),
+                               "shakyo")
 
 DELETE_CHARS = ck.DELETE_CHARS | ck.BACKSPACE_CHARS
 QUIT_CHARS = ck.ESCAPE_CHARS
@@ -16,3 +22,5 @@ SCROLL_DOWN_CHAR = ck.ctrl('n')
 SCROLL_UP_CHAR = ck.ctrl('p')
 PAGE_DOWN_CHAR = ck.ctrl('f')
 PAGE_UP_CHAR = ck.ctrl('b')
+GOTO_LINE_CHAR = ck.ctrl('g')
+SEARCH_CHAR = ck.ctrl('r')
@@ -1,7 +1,9 @@
 import curses
 
-from .character import Character
+from .character import Character, string_width
 from .console import Console
+from .headless_console import HeadlessConsole
 from .line import Line
-from .misc import ESCAPE_CHARS, DELETE_CHARS, BACKSPACE_CHARS, \
-                  is_printable_char, ctrl, unctrl
+from .truecolor_console import TruecolorConsole, is_truecolor_terminal
+from .misc import ESCAPE_CHARS, DELETE_CHARS, BACKSPACE_CHARS, RESIZE_CHAR, \
+                  is_printable_char, is_printable_string, ctrl, unctrl
@@ -4,6 +4,9 @@ import enum
 
 
 _CURSES_COLOR_SCALE = 1000
+_CELLS_PER_AXIS = 16
+_RGB_BOUNDS = ((0, 256),) * 3
+_LAB_BOUNDS = ((0, 100), (-128, 128), (-128, 128))
 
 
 
@@ -23,12 +26,21 @@ class ColorAttribute:
   _colors = []
   _rgb_to_attr = {}
   _background_rgb = None
+  _perceptual = False
+  _table = None
+  _table_attrs = []
 
   @classmethod
-  def initialize(cls, background_rgb=(0, 0, 0)):
+  def initialize(cls, background_rgb=(0, 0, 0), perceptual=False):
+    """
+    Set up colors of a terminal.
+    If perceptual is True, colors are matched by their distance in the CIE
+    L*a*b* color space (CIE76) instead of the one in the RGB color space.
+    """
     if not curses.has_colors(): return
     cls._set_up_colors()
     cls._background_rgb = background_rgb
+    cls._perceptual = perceptual
 
   @classmethod
   def get_best_match(cls, rgb):
@@ -57,20 +69,23 @@ class ColorAttribute:
   @classmethod
   def _find_best_match(cls, new_rgb):
     assert cls._is_valid_rgb(new_rgb)
-    matched_attr = curses.color_pair(0) # white on black
-    min_distance = cls._color_distance((0, 0, 0), (255, 255, 255))
-    for rgb, attr in cls._colors:
-      if rgb == cls._background_rgb: continue
-      distance = cls._color_distance(new_rgb, rgb)
-      if distance < min_distance:
-        min_distance = distance
-        matched_attr = attr
-    return matched_attr
 
-  @classmethod
-  def _color_distance(cls, rgb1, rgb2):
-    assert cls._is_valid_rgb(rgb1) and cls._is_valid_rgb(rgb2)
-    return sum((color1 - color2) ** 2 for color1, color2 in zip(rgb1, rgb2))
+    if cls._table is None:
+      colors = [(rgb, attr) for rgb, attr in cls._colors
+                if rgb != cls._background_rgb]
+      if cls._perceptual:
+        cls._table = _NearestPointTable(
+            [_rgb_to_lab(rgb) for rgb, _ in colors], _LAB_BOUNDS)
+      else:
+        cls._table = _NearestPointTable([rgb for rgb, _ in colors],
+                                        _RGB_BOUNDS)
+      cls._table_attrs = [attr for _, attr in colors]
+
+    index = cls._table.find_nearest(_rgb_to_lab(new_rgb) if cls._perceptual
+                                    else new_rgb)
+    if index is None:
+      return curses.color_pair(0) # white on black
+    return cls._table_attrs[index]
 
   @staticmethod
   def _is_valid_rgb(rgb):
@@ -81,3 +96,101 @@ class ColorAttribute:
   def _get_rgb_by_color_index(color_index):
     return tuple((color * 255) // _CURSES_COLOR_SCALE
                  for color in curses.color_content(color_index))
+
+
+class _NearestPointTable:
+  """
+  A table to find the nearest one of fixed points in a 3-D box.
+  The box is divided into cells and each cell has a list of candidates,
+  which are the points possibly nearest to some point in the cell.
+  The lists are made on demand, so that finding the nearest point takes
+  constant time except the first time in each cell.
+  """
+
+  def __init__(self, points, bounds):
+    self._points = points
+    self._bounds = bounds
+    self._cell_to_candidates = {}
+
+    # Squared distances from points to the nearest and farthest sides of
+    # each slab of cells along each axis
+    self._min_slab_distances = []
+    self._max_slab_distances = []
+    for axis, (lower, upper) in enumerate(bounds):
+      slabs = [(lower + (upper - lower) * index / _CELLS_PER_AXIS,
+                lower + (upper - lower) * (index + 1) / _CELLS_PER_AXIS)
+               for index in range(_CELLS_PER_AXIS)]
+      self._min_slab_distances.append(
+          [[max(lower - point[axis], 0, point[axis] - upper) ** 2
+            for point in points]
+           for lower, upper in slabs])
+      self._max_slab_distances.append(
+          [[max(point[axis] - lower, upper - point[axis]) ** 2
+            for point in points]
+           for lower, upper in slabs])
+
+  def find_nearest(self, point):
+    """
+    Return the index of the nearest point or None if there is no point.
+    Ties are broken by the smallest index.
+    """
+    if len(self._points) == 0:
+      return None
+
+    cell = self._point_to_cell(point)
+    if cell not in self._cell_to_candidates:
+      self._cell_to_candidates[cell] = self._find_candidates(cell)
+
+    return min(self._cell_to_candidates[cell],
+               key=lambda index: (_squared_distance(point, self._points[index]),
+                                  index))
+
+  def _point_to_cell(self, point):
+    return tuple(min(max(int((coordinate - lower) * _CELLS_PER_AXIS
+                             / (upper - lower)), 0),
+                     _CELLS_PER_AXIS - 1)
+                 for coordinate, (lower, upper) in zip(point, self._bounds))
+
+  def _find_candidates(self, cell):
+    min_distances = list(map(_sum, *(
+        slab_distances[index]
+        for slab_distances, index in zip(self._min_slab_distances, cell))))
+    max_distances = map(_sum, *(
+        slab_distances[index]
+        for slab_distances, index in zip(self._max_slab_distances, cell)))
+
+    # The nearest point to any point in the cell is not farther from the
+    # cell than the farthest corner of the cell from any other point.
+    max_distance = min(max_distances)
+    return [index for index, distance in enumerate(min_distances)
+            if distance <= max_distance]
+
+
+
+def _sum(*numbers):
+  return sum(numbers)
+
+
+def _squared_distance(point1, point2):
+  return sum((coordinate1 - coordinate2) ** 2
+             for coordinate1, coordinate2 in zip(point1, point2))
+
+
+def _rgb_to_lab(rgb):
+  """
+  Convert a color in the sRGB color space into the CIE L*a*b* color space
+  with the D65 white point.
+  """
+  linear_rgb = [color / 12.92 if color <= 0.04045
+                else ((color + 0.055) / 1.055) ** 2.4
+                for color in (color / 255 for color in rgb)]
+  xyz = [sum(coefficient * color
+             for coefficient, color in zip(coefficients, linear_rgb))
+         / white
+         for coefficients, white in [((0.4124, 0.3576, 0.1805), 0.95047),
+                                     ((0.2126, 0.7152, 0.0722), 1.0),
+                                     ((0.0193, 0.1192, 0.9505), 1.08883)]]
+  x, y, z = [value ** (1 / 3) if value > 216 / 24389
+             else (24389 / 27 * value + 16) / 116
+             for value in xyz]
+  return (116 * y - 16, 500 * (x - y), 200 * (y - z))
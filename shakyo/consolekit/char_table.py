@@ -0,0 +1,257 @@
+import functools
+import re
+import threading
+import unicodedata
+
+
+
+# constants
+
+# Properties of a character are packed into a byte.
+_WIDTH_MASK = 0b11
+_UNPRINTABLE = 1 << 2
+_UNNORMALIZED = 1 << 3 # NFC or conversion of separators into spaces changes
+                       # a character.
+_CONTEXTUAL = 1 << 4 # Its width depends on characters around it.
+_SIMPLE_MASK = _UNPRINTABLE | _UNNORMALIZED | _CONTEXTUAL
+
+_BLOCK_BITS = 8
+_BLOCK_SIZE = 1 << _BLOCK_BITS
+_NUMBER_OF_BLOCKS = (0x10ffff >> _BLOCK_BITS) + 1
+_ZERO_WIDTH_JOINER = "\u200d"
+_ZERO_WIDTH_NON_JOINER = "\u200c"
+_PRINTABLE_FORMAT_CHARS = {'\t', _ZERO_WIDTH_JOINER, _ZERO_WIDTH_NON_JOINER}
+_ZERO_WIDTH_CATEGORIES = {"Mn", "Me"}
+_ZERO_WIDTH_RANGES = [
+  (0x1160, 0x11ff), # medial vowels and final consonants of Hangul
+  (0x1f3fb, 0x1f3ff), # emoji modifiers
+]
+_REGIONAL_INDICATOR_RANGE = (0x1f1e6, 0x1f1ff)
+_EMPTY_CHARACTER_CLASS = r"[^\x00-\U0010ffff]"
+_RUN_PATTERN_FORMAT = (r"(?P<tab>\t)"
+                       # A character after a zero width joiner is a part of
+                       # the grapheme cluster before it.
+                       r"|(?P<joined>\u200d(?:{zero}|{narrow}|{wide}))"
+                       r"|(?P<flag>{flag}{{2}})"
+                       r"|(?P<zero>{zero}+)"
+                       r"|(?P<narrow>{narrow}+)"
+                       r"|(?P<wide>{wide}+)"
+                       r"|(?P<other>.)")
+
+
+
+# classes
+
+class _CharTable:
+  """
+  A two-level table of properties of characters whose blocks of code points
+  are made on demand.
+  Regular expressions of characters in the blocks made so far let strings
+  be processed by runs of characters instead of one by one.
+  They are compiled again only when the number of blocks made doubles since
+  characters in the other blocks give the same results one by one, except
+  ones after zero width joiners, whose blocks are always compiled.
+  """
+
+  def __init__(self):
+    self._blocks = [None] * _NUMBER_OF_BLOCKS
+    self._lock = threading.Lock()
+    self._class_ranges = {"zero" : [], "narrow" : [], "wide" : [],
+                          "printable" : []}
+    self._loaded_block_indices = []
+    self._compiled_block_indices = set()
+    self._patterns = None
+    self._load_block(0) # ASCII
+
+  def properties(self, char):
+    code_point = ord(char)
+    block = self._blocks[code_point >> _BLOCK_BITS]
+    if block is None:
+      block = self._load_block(code_point >> _BLOCK_BITS)
+    return block[code_point & (_BLOCK_SIZE - 1)]
+
+  def runs(self, string):
+    index = string.find(_ZERO_WIDTH_JOINER)
+    while index != -1 and index + 1 < len(string):
+      joined_char = string[index + 1]
+      if ord(joined_char) >> _BLOCK_BITS not in self._compiled_block_indices:
+        self.properties(joined_char)
+        with self._lock:
+          self._patterns = None
+      index = string.find(_ZERO_WIDTH_JOINER, index + 1)
+    return self._get_patterns()[0].finditer(string)
+
+  @property
+  def printable_pattern(self):
+    return self._get_patterns()[1]
+
+  def _get_patterns(self):
+    patterns = self._patterns
+    if patterns is None:
+      with self._lock:
+        character_classes = {name : _character_class(ranges)
+                             for name, ranges in self._class_ranges.items()}
+        patterns = (re.compile(_RUN_PATTERN_FORMAT.format(
+                                   flag=_character_class(
+                                       [_range(*_REGIONAL_INDICATOR_RANGE)]),
+                                   **character_classes),
+                               re.DOTALL),
+                    re.compile(character_classes["printable"] + "*"))
+        self._patterns = patterns
+        self._compiled_block_indices = set(self._loaded_block_indices)
+    return patterns
+
+  def _load_block(self, block_index):
+    start = block_index << _BLOCK_BITS
+    block = bytes(_compute_properties(chr(code_point))
+                  for code_point in range(start, start + _BLOCK_SIZE))
+
+    with self._lock:
+      if self._blocks[block_index] is None:
+        for name, predicate in [
+            ("zero", lambda properties: properties & _SIMPLE_MASK == 0
+                                        and properties & _WIDTH_MASK == 0),
+            ("narrow", lambda properties: properties & _SIMPLE_MASK == 0
+                                          and properties & _WIDTH_MASK == 1),
+            ("wide", lambda properties: properties & _SIMPLE_MASK == 0
+                                        and properties & _WIDTH_MASK == 2),
+            ("printable", lambda properties:
+                              not properties & _UNPRINTABLE)]:
+          self._class_ranges[name].extend(_ranges(start, block, predicate))
+        self._blocks[block_index] = block
+        self._loaded_block_indices.append(block_index)
+        if len(self._loaded_block_indices) \
+           >= 2 * len(self._compiled_block_indices):
+          self._patterns = None
+    return block
+
+
+
+# functions
+
+def char_width(char):
+  """
+  Width of a character by itself.
+  Combining marks and other characters joined to previous ones have no
+  width.
+  """
+  return _char_table().properties(char) & _WIDTH_MASK
+
+
+def is_printable_char(char):
+  return not _char_table().properties(char) & _UNPRINTABLE
+
+
+def is_normalized_char(char):
+  """
+  Tell if a character is normalized into itself by NFC and is not a
+  separator.
+  """
+  return not _char_table().properties(char) & _UNNORMALIZED
+
+
+def is_printable_string(string):
+  end = _char_table().printable_pattern.match(string).end()
+  return end == len(string) or all(map(is_printable_char, string[end:]))
+
+
+def runs(string):
+  """
+  Split a string into runs of characters named by groups of matches.
+  Characters in a run of "zero", "narrow" or "wide" are normalized into
+  themselves and have the width of 0, 1 or 2 respectively.
+  A "joined" run is a zero width joiner and a character joined by it, and
+  a "flag" run is a pair of regional indicators.
+  "tab" and "other" runs are single characters.
+  """
+  return _char_table().runs(string)
+
+
+def run_widths(match):
+  """
+  Widths of characters in a run other than "other" ones.
+  """
+  name = match.lastgroup
+  if name == "zero" or name == "joined":
+    return [0] * len(match.group())
+  elif name == "flag":
+    return [2, 0]
+  return [2 if name == "wide" else 1] * len(match.group())
+
+
+def string_width(string):
+  """
+  Width of a string in grapheme clusters without expansion of tabs.
+  """
+  if len(string) == 1: # e.g. a character typed by a user
+    return char_width(string)
+
+  width = 0
+  for match in runs(string):
+    name = match.lastgroup
+    if name == "narrow" or name == "tab":
+      width += match.end() - match.start()
+    elif name == "wide":
+      width += 2 * (match.end() - match.start())
+    elif name == "flag":
+      width += 2
+    elif name == "other":
+      width += char_width(match.group())
+  return width
+
+
+@functools.lru_cache(maxsize=None)
+def _char_table():
+  return _CharTable()
+
+
+def _compute_properties(char):
+  category = unicodedata.category(char)
+  code_point = ord(char)
+
+  if category in _ZERO_WIDTH_CATEGORIES \
+     or char in {_ZERO_WIDTH_JOINER, _ZERO_WIDTH_NON_JOINER} \
+     or any(first <= code_point <= last
+            for first, last in _ZERO_WIDTH_RANGES):
+    properties = 0
+  elif unicodedata.east_asian_width(char) in {"W", "F"}:
+    properties = 2
+  else:
+    properties = 1
+
+  if category.startswith("C") and char not in _PRINTABLE_FORMAT_CHARS:
+    properties |= _UNPRINTABLE
+  if (category.startswith("Z") and char != ' ') \
+     or unicodedata.normalize("NFC", char) != char:
+    properties |= _UNNORMALIZED
+  if char in {'\t', _ZERO_WIDTH_JOINER} \
+     or _REGIONAL_INDICATOR_RANGE[0] <= code_point \
+        <= _REGIONAL_INDICATOR_RANGE[1]:
+    properties |= _CONTEXTUAL
+  return properties
+
+
+def _ranges(start, block, predicate):
+  """
+  Make ranges of characters in a character class of a regular expression
+  from the ones in a block which satisfy a predicate.
+  """
+  ranges = []
+  first = None
+  for index, properties in enumerate(list(block) + [None]):
+    if properties is not None and predicate(properties):
+      if first is None:
+        first = index
+    elif first is not None:
+      ranges.append(_range(start + first, start + index - 1))
+      first = None
+  return ranges
+
+
+def _range(first, last):
+  return "\\U{:08x}-\\U{:08x}".format(first, last)
+
+
+def _character_class(ranges):
+  return "[{}]".format("".join(ranges)) if len(ranges) != 0 else \
+         _EMPTY_CHARACTER_CLASS
@@ -1,10 +1,11 @@
-import unicodedata
-
 from . import attribute
+from . import char_table
 from . import misc
 
 
 
+# classes
+
 class Character:
   def __init__(self, string, attr=attribute.DecorationAttribute.normal):
     assert misc.is_printable_char(string) and isinstance(attr, int)
@@ -23,4 +24,15 @@ class Character:
 
   @property
   def width(self):
-    return 2 if unicodedata.east_asian_width(self._string) in {"W", "F"} else 1
+    return char_width(self._string)
+
+
+
+# functions
+
+def char_width(string_char):
+  return char_table.char_width(string_char)
+
+
+def string_width(string):
+  return char_table.string_width(string)
@@ -1,19 +1,40 @@
+import array
+import bisect
 import curses
-import unicodedata
+import itertools
 
 from . import line as ln
 from . import attribute
+from . import misc
 
 
 
+# constants
+
+_BLANK_CELL = (' ', 0)
+_CONTINUATION = "" # string of the right halves of wide characters
+
+
+
+# classes
+
 class Console:
+  """
+  A console which draws lines through a shadow buffer.
+  Lines are printed into a buffer of cells of (string, attribute) pairs
+  first and only cells different from the ones on a screen are drawn by
+  refresh().
+  """
+
   def __init__(self,
                asciize=False,
                spaces_per_tab=4,
-               background_rgb=(0, 0, 0)):
+               background_rgb=(0, 0, 0),
+               perceptual_colors=False):
     ln.Line._ASCIIZE = asciize
     ln.Line._SPACES_PER_TAB = spaces_per_tab
     self._background_rgb = background_rgb
+    self._perceptual_colors = perceptual_colors
 
   def _initialize_window(self):
     self._window = curses.initscr()
@@ -24,11 +45,22 @@ class Console:
     self._window.clear()
     self._window.move(0, 0)
     self._window.refresh()
+    self._initialize_buffers(*self._get_screen_size())
+
+  def _initialize_buffers(self, screen_height, screen_width):
+    self._screen_height = screen_height
+    self._screen_width = screen_width
+    self._drawn_rows = [self._blank_row() for _ in range(screen_height)]
+    self._rows = list(self._drawn_rows)
+    self._cursor = (0, 0)
+    self._narrow_column_offsets = array.array("I", range(screen_width + 1))
 
   def _initialize_colors(self):
     curses.start_color()
     curses.use_default_colors()
-    attribute.ColorAttribute.initialize(background_rgb=self._background_rgb)
+    attribute.ColorAttribute.initialize(
+        background_rgb=self._background_rgb,
+        perceptual=self._perceptual_colors)
 
   def turn_on(self):
     self._initialize_window()
@@ -58,60 +90,200 @@ class Console:
 
   def _keep_position(method):
     def wrapper(self, *args, **keyword_args):
-      position = self._window.getyx()
+      position = self._cursor
       result = method(self, *args, **keyword_args)
-      self._window.move(*position)
+      self._cursor = position
       return result
     return wrapper
 
   @property
   def screen_height(self):
-    return self._window.getmaxyx()[0]
+    return self._screen_height
 
   @property
   def screen_width(self):
-    return self._window.getmaxyx()[1]
+    return self._screen_width
 
   def get_char(self) -> str:
-    if hasattr(self._window, "get_wch"):
-      char = self._window.get_wch()
-    else:
-      char = self._window.getch()
-
-    if isinstance(char, int):
-      return chr(char)
-    assert isinstance(char, str)
+    """
+    Read a character typed by a user.
+    RESIZE_CHAR is returned after a screen is resized and its buffers are
+    made again, so that everything is printed and drawn again.
+    """
+    self.refresh()
+    char = self._read_char()
+    if char == misc.RESIZE_CHAR:
+      self._resize()
     return char
 
+  def get_chars(self, timeout=None):
+    """
+    Read all characters typed so far at once without drawing the buffer.
+    The first one is waited for until timeout in seconds passes, or
+    forever if timeout is None, and no character is returned if none is
+    typed.
+    Characters end at RESIZE_CHAR, after which the buffer is blank.
+    """
+    chars = []
+    char = self._read_char(timeout)
+    while char is not None:
+      chars.append(char)
+      if char == misc.RESIZE_CHAR:
+        self._resize()
+        break
+      char = self._read_char(0)
+    return chars
+
   def print_line(self, y, line, clear=True):
+    """
+    Print a line at a row of the buffer.
+    Without clear, the line overwrites cells from the left of the row and
+    the rest of the row is kept.
+    """
     assert 0 <= y < self.screen_height
     assert isinstance(line, ln.Line)
 
-    self._window.move(y, 0)
-    if clear:
-      self._window.clrtoeol()
+    line = line.normalized
+    string = str(line)
+    assert '\t' not in string and misc.is_printable_string(string)
+    column_offsets = line.column_offsets
+    length = bisect.bisect_right(column_offsets, self.screen_width) - 1
+    width = column_offsets[length]
 
-    for char in line.normalized:
-      assert not unicodedata.category(str(char)).startswith("C")
-      if self._window.getyx()[1] + char.width > self.screen_width:
-        break
-      self._window.addstr(str(char), char.attr)
+    row = self._blank_row() if clear else list(self._rows[y])
+    if column_offsets[:length + 1] \
+       == self._narrow_column_offsets[:length + 1]:
+      row[:length] = zip(string[:length], line.attrs[:length])
+    else:
+      cell_column = None
+      for string_char, attr, column, next_column \
+          in zip(string[:length], line.attrs, column_offsets,
+                 itertools.islice(column_offsets, 1, None)):
+        # Characters without width join cells of previous ones as grapheme
+        # clusters.
+        if next_column == column:
+          if cell_column is not None:
+            cell_string, cell_attr = row[cell_column]
+            row[cell_column] = (cell_string + string_char, cell_attr)
+          continue
+        row[column] = (string_char, attr)
+        if next_column - column == 2:
+          row[column + 1] = (_CONTINUATION, attr)
+        cell_column = column
+
+    # A wide character whose left half is overwritten is erased.
+    if width < self.screen_width and row[width][0] == _CONTINUATION:
+      row[width] = _BLANK_CELL
+
+    self._rows[y] = row
+    self._cursor = (y, min(width, self.screen_width - 1))
 
   @_keep_position
   def erase(self):
-    self._window.erase()
+    self._erase_screen()
+    self._drawn_rows = [self._blank_row() for _ in range(self.screen_height)]
+    self._rows = list(self._drawn_rows)
 
   def refresh(self):
-    self._window.refresh()
+    for y, (drawn_row, row) in enumerate(zip(self._drawn_rows, self._rows)):
+      if drawn_row != row:
+        self._draw_row(y, drawn_row, row)
+        self._drawn_rows[y] = row
+    self._update_screen()
 
   @_keep_position
   def scroll(self, line=None, direction="down"):
     assert direction in {"up", "down"}
     assert isinstance(line, ln.Line) or line is None
 
-    self._window.scroll(1 if direction == "down" else -1)
+    # Rows already drawn are scrolled on a screen as well as in buffers.
+    self._scroll_screen(direction)
+    for rows in [self._drawn_rows, self._rows]:
+      if direction == "down":
+        rows.pop(0)
+        rows.append(self._blank_row())
+      else:
+        rows.pop()
+        rows.insert(0, self._blank_row())
 
     if line is not None and direction == "down":
       self.print_line(self.screen_height - 1, line)
     elif line is not None and direction == "up":
       self.print_line(0, line)
+
+  def _resize(self):
+    self._initialize_buffers(*self._get_screen_size())
+    self._erase_screen()
+
+  def _blank_row(self):
+    return [_BLANK_CELL] * self.screen_width
+
+  def _draw_row(self, y, drawn_row, row):
+    # Trailing blank cells are cleared at once.
+    blank_column = len(row)
+    while blank_column > 0 and row[blank_column - 1] == _BLANK_CELL:
+      blank_column -= 1
+
+    column = 0
+    while column < blank_column:
+      if drawn_row[column] == row[column]:
+        column += 1
+        continue
+
+      start = column
+      while column < blank_column and drawn_row[column] != row[column]:
+        column += 1
+      if row[start][0] == _CONTINUATION:
+        start -= 1
+      if column < len(row) and row[column][0] == _CONTINUATION:
+        column += 1
+      self._draw_cells(y, start, row[start:column])
+
+    if any(cell != _BLANK_CELL for cell in drawn_row[blank_column:]):
+      self._clear_row(y, blank_column)
+
+  # Methods below operate on a screen and are overridden by other backends.
+
+  def _get_screen_size(self):
+    return self._window.getmaxyx()
+
+  def _read_char(self, timeout=None):
+    """
+    Read a character, or return None if none is typed until timeout.
+    """
+    self._window.timeout(-1 if timeout is None else int(timeout * 1000))
+    try:
+      if hasattr(self._window, "get_wch"):
+        char = self._window.get_wch()
+      else:
+        char = self._window.getch()
+    except curses.error: # no key in time
+      return None
+
+    if char == curses.ERR:
+      return None
+    elif isinstance(char, int):
+      return chr(char)
+    assert isinstance(char, str)
+    return char
+
+  def _draw_cells(self, y, x, cells):
+    # Consecutive characters with the same attribute are drawn at once.
+    self._window.move(y, x)
+    for attr, attr_cells in itertools.groupby(cells, key=lambda cell: cell[1]):
+      self._window.addstr("".join(string for string, _ in attr_cells), attr)
+
+  def _clear_row(self, y, x):
+    self._window.move(y, x)
+    self._window.clrtoeol()
+
+  def _erase_screen(self):
+    self._window.erase()
+
+  def _scroll_screen(self, direction):
+    self._window.scroll(1 if direction == "down" else -1)
+
+  def _update_screen(self):
+    self._window.move(*self._cursor)
+    self._window.noutrefresh()
+    curses.doupdate()
@@ -0,0 +1,85 @@
+import collections
+import curses.ascii
+
+from . import console
+from . import misc
+from . import truecolor_console
+
+
+
+# classes
+
+class HeadlessConsole(console.Console):
+  """
+  A console which has a screen only in memory and reads scripted keys
+  instead of ones typed on a terminal.
+  Keys are typed one by one, and characters of a string with more than one
+  of them are typed at once like pasted ones.
+  A pair of a height and a width among the keys resizes the screen.
+  The escape key is returned after all the keys are read.
+  """
+
+  def __init__(self,
+               keys=(),
+               screen_height=24,
+               screen_width=80,
+               **keyword_args):
+    super().__init__(**keyword_args)
+    self._keys = iter(keys)
+    self._pasted_chars = collections.deque()
+    self._size = (screen_height, screen_width)
+    self._color_attrs = truecolor_console.TruecolorAttribute(
+        self._background_rgb)
+
+  def turn_on(self):
+    self._initialize_buffers(*self._get_screen_size())
+
+  def turn_off(self):
+    pass
+
+  @property
+  def color_attrs(self):
+    return self._color_attrs
+
+  @property
+  def screen(self):
+    """
+    Strings of rows on a screen
+    """
+    self.refresh()
+    return ["".join(string for string, _ in row) for row in self._drawn_rows]
+
+  @property
+  def cursor(self):
+    return self._cursor
+
+  def _get_screen_size(self):
+    return self._size
+
+  def _read_char(self, timeout=None):
+    if len(self._pasted_chars) != 0:
+      return self._pasted_chars.popleft()
+    elif timeout is not None: # The next key is not typed yet.
+      return None
+
+    key = next(self._keys, chr(curses.ascii.ESC))
+    if not isinstance(key, str):
+      self._size = tuple(key)
+      return misc.RESIZE_CHAR
+    self._pasted_chars.extend(key[1:])
+    return key[0]
+
+  def _draw_cells(self, y, x, cells):
+    pass
+
+  def _clear_row(self, y, x):
+    pass
+
+  def _erase_screen(self):
+    pass
+
+  def _scroll_screen(self, direction):
+    pass
+
+  def _update_screen(self):
+    pass
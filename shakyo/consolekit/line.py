@@ -1,89 +1,292 @@
-import text_unidecode
+import array
+import bisect
+import functools
+import itertools
+import operator
+import re
 import unicodedata
 
+from . import char_table
 from . import character
+from . import misc
 
 
 
+# constants
+
+_ATTR_TYPECODE = "I" # curses attributes fit in 32 bits
+_OFFSET_TYPECODE = "I"
+_ASCII_PATTERN = re.compile(r"[ -~]*")
+
+
+
+# classes
+
 class Line:
   """
   A class whose instances represent one-line text on a console.
   Line instances are immutable.
+
+  Characters are not kept as Character objects but as a string of code
+  points and a parallel array of their attributes.
+  Character objects are created only when they are accessed one by one.
   """
 
   _SPACES_PER_TAB = 4
   _ASCIIZE = False
 
+  # caches computed on demand
+  _is_normalized = False
+  _normalized_line = None
+  _column_offsets = None
+
   def __init__(self, *chars):
     assert all(isinstance(char, character.Character) for char in chars)
-    self._chars = chars
+    self._string = "".join(str(char) for char in chars)
+    self._attrs = array.array(_ATTR_TYPECODE, (char.attr for char in chars))
+
+  @classmethod
+  def from_string(cls, string, attrs):
+    assert misc.is_printable_string(string)
+    attrs = array.array(_ATTR_TYPECODE, attrs)
+    return cls._from_string_and_attrs(string, attrs)
+
+  @classmethod
+  def _from_string_and_attrs(cls, string, attrs):
+    assert isinstance(string, str) and isinstance(attrs, array.array)
+    assert len(string) == len(attrs)
+    line = cls.__new__(cls)
+    line._string = string
+    line._attrs = attrs
+    return line
 
   def __len__(self):
-    return len(self._chars)
+    return len(self._string)
+
+  def __str__(self):
+    return self._string
 
   def __eq__(self, line):
     if line is None: return False
     assert isinstance(line, Line)
-
-    if len(self) != len(line): return False
-    for my_char, your_char in zip(self, line):
-      if my_char != your_char: return False
-    return True
+    return self._string == line._string
 
   def __iter__(self):
-    for char in self._chars:
-      yield char
+    for string_char, attr in zip(self._string, self._attrs):
+      yield character.Character(string_char, attr)
 
   def __add__(self, char_or_line):
     if isinstance(char_or_line, character.Character):
       char = char_or_line
-      return Line(*self, char)
+      attrs = array.array(_ATTR_TYPECODE, self._attrs)
+      attrs.append(char.attr)
+      return Line._from_string_and_attrs(self._string + str(char), attrs)
     assert isinstance(char_or_line, Line)
     line = char_or_line
-    return Line(*self, *line)
+    return Line._from_string_and_attrs(self._string + line._string,
+                                       self._attrs + line._attrs)
 
   def __radd__(self, char):
     assert isinstance(char, character.Character)
-    return Line(char, *self)
+    return Line._from_string_and_attrs(
+        str(char) + self._string,
+        array.array(_ATTR_TYPECODE, [char.attr]) + self._attrs)
 
   def __getitem__(self, key):
     if isinstance(key, int):
-      return self._chars[key]
+      return character.Character(self._string[key], self._attrs[key])
     assert isinstance(key, slice)
-    return Line(*self._chars[key])
+    return Line._from_string_and_attrs(self._string[key], self._attrs[key])
+
+  @property
+  def attrs(self):
+    return self._attrs
 
   @property
   def normalized(self):
-    return Line(*self._normalized_chars)
+    if self._is_normalized:
+      return self
+    if self._normalized_line is None:
+      self._normalize()
+    return self._normalized_line
 
   @property
   def width(self):
-    return sum(char.width for char in self.normalized)
+    return self.column_offsets[-1]
 
   @property
-  def _normalized_chars(self):
-    position = 0
-    for char in self._chars:
-      if char == '\t':
-        boundary = self._next_tab_boundary(position)
-        while position != boundary:
-          position += 1
-          yield character.Character(' ', char.attr)
+  def column_offsets(self):
+    """
+    Display columns at which characters start.
+    Its k-th element is equal to the width of self[:k] and the last one is
+    equal to the width of the whole line.
+    """
+    if self._column_offsets is None:
+      self._normalize()
+    return self._column_offsets
+
+  def fold(self, max_width):
+    """
+    Split a line into lines whose widths are not greater than max_width.
+    Each line is sliced once from this line and its tabs are expanded from
+    its own beginning.
+    A character wider than max_width makes a line by itself.
+    """
+    assert max_width > 0
+
+    start_index = 0
+    while True:
+      stop_index = self._fold_index(start_index, max_width)
+      if stop_index >= len(self):
+        yield self[start_index:] if start_index != 0 else self
+        return
+      yield self[start_index:stop_index]
+      start_index = stop_index
+
+  def _fold_index(self, start_index, max_width):
+    column_offsets = self.column_offsets
+    index = start_index
+    column = 0
+
+    # Widths of characters other than tabs do not depend on their columns,
+    # so the end of each run of them is found by binary search.
+    while True:
+      base_column = column_offsets[index] - column
+      stop_index = bisect.bisect_right(column_offsets,
+                                       base_column + max_width,
+                                       index) - 1
+      tab_index = self._string.find('\t', index, stop_index + 1)
+      if tab_index == -1:
+        return max(stop_index, start_index + 1)
+
+      column = column_offsets[tab_index] - base_column
+      column_after_tab = self._next_tab_boundary(column)
+      if column_after_tab > max_width:
+        return max(tab_index, start_index + 1)
+      column = column_after_tab
+      index = tab_index + 1
+
+  def _normalize(self):
+    if _ASCII_PATTERN.fullmatch(self._string):
+      self._normalize_ascii()
+      return
+
+    strings = []
+    attrs = array.array(_ATTR_TYPECODE)
+    column_offsets = array.array(_OFFSET_TYPECODE, [0])
+    normalized_column_offsets = array.array(_OFFSET_TYPECODE, [0])
+
+    # Characters other than tabs are normalized independently of their
+    # columns, so runs of them are normalized and accumulated in bulk.
+    for match in char_table.runs(self._string):
+      segment = match.group()
+      segment_attrs = self._attrs[match.start():match.end()]
+      column = column_offsets[-1]
+
+      if match.lastgroup == "tab":
+        spaces = self.normalize_char(segment, column)
+        strings.append(spaces)
+        attrs.extend(segment_attrs * len(spaces))
+        normalized_column_offsets.extend(
+            range(column + 1, column + len(spaces) + 1))
+        column_offsets.append(column + len(spaces))
+        continue
+      elif match.lastgroup == "narrow" \
+           and (not self._ASCIIZE or _ASCII_PATTERN.fullmatch(segment)):
+        strings.append(segment)
+        attrs.extend(segment_attrs)
+        for offsets in [column_offsets, normalized_column_offsets]:
+          offsets.extend(range(column + 1, column + len(segment) + 1))
+        continue
+      elif match.lastgroup != "other" and not self._ASCIIZE:
+        # Characters in the run are normalized into themselves.
+        strings.append(segment)
+        attrs.extend(segment_attrs)
+        if match.lastgroup == "wide":
+          column_offsets.extend(range(column + 2,
+                                      column + 2 * len(segment) + 1,
+                                      2))
+        else:
+          column_offsets.extend(_accumulate(char_table.run_widths(match),
+                                            column))
+        normalized_column_offsets.extend(
+            column_offsets[len(column_offsets) - len(segment):])
+        continue
+
+      results = list(map(_normalize_string_char,
+                         segment,
+                         itertools.repeat(self._ASCIIZE)))
+      segment_strings = list(map(operator.itemgetter(0), results))
+
+      strings.extend(segment_strings)
+      if set(map(len, segment_strings)) <= {1}:
+        attrs.extend(segment_attrs)
       else:
-        for normalized_char in self._normalize_char(char):
-          position += normalized_char.width
-          yield normalized_char
+        attrs.extend(itertools.chain.from_iterable(
+            itertools.repeat(attr, len(string))
+            for attr, string in zip(segment_attrs, segment_strings)))
+      normalized_column_offsets.extend(_accumulate(
+          itertools.chain.from_iterable(map(operator.itemgetter(1), results)),
+          column))
+      column_offsets.extend(_accumulate(map(operator.itemgetter(2), results),
+                                        column))
+
+    self._set_normalized(
+        Line._from_string_and_attrs("".join(strings), attrs),
+        column_offsets,
+        normalized_column_offsets)
+
+  def _normalize_ascii(self):
+    # printable ASCII characters except tabs are normalized into themselves
+    offsets = array.array(_OFFSET_TYPECODE, range(len(self) + 1))
+    self._set_normalized(Line._from_string_and_attrs(self._string,
+                                                     self._attrs),
+                         offsets,
+                         offsets)
+
+  def _set_normalized(self,
+                      normalized_line,
+                      column_offsets,
+                      normalized_column_offsets):
+    normalized_line._is_normalized = True
+    normalized_line._column_offsets = normalized_column_offsets
+    self._normalized_line = normalized_line
+    self._column_offsets = column_offsets
+
+  @classmethod
+  def normalize_char(cls, string_char, column=0):
+    """
+    Normalize a character placed at a column into a string.
+    """
+    if string_char == '\t':
+      return ' ' * (cls._next_tab_boundary(column) - column)
+    return _normalize_string_char(string_char, cls._ASCIIZE)[0]
 
   @classmethod
   def _next_tab_boundary(cls, position):
     return (position // cls._SPACES_PER_TAB + 1) * cls._SPACES_PER_TAB
 
-  @classmethod
-  def _normalize_char(cls, char):
-    if cls._ASCIIZE:
-      return [character.Character(string_char, char.attr)
-              for string_char in text_unidecode.unidecode(str(char))]
-    return [character.Character(string_char, char.attr)
-            if not unicodedata.category(string_char).startswith("Z")
-            else character.Character(' ', char.attr)
-            for string_char in unicodedata.normalize("NFC", str(char))]
+
+
+# functions
+
+@functools.lru_cache(maxsize=None)
+def _normalize_string_char(string_char, asciize):
+  if asciize:
+    import text_unidecode # Its table takes long to be loaded.
+    normalized_string = text_unidecode.unidecode(string_char)
+  elif char_table.is_normalized_char(string_char):
+    normalized_string = string_char
+  else:
+    normalized_string = "".join(
+        ' ' if unicodedata.category(normalized_char).startswith("Z")
+        else normalized_char
+        for normalized_char in unicodedata.normalize("NFC", string_char))
+  char_widths = tuple(character.char_width(normalized_char)
+                      for normalized_char in normalized_string)
+  return normalized_string, char_widths, sum(char_widths)
+
+
+def _accumulate(numbers, initial):
+  return itertools.islice(
+      itertools.accumulate(itertools.chain([initial], numbers)), 1, None)
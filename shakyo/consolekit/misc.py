@@ -1,14 +1,24 @@
 import curses
 import curses.ascii
-import unicodedata
+import re
 from curses.ascii import ctrl, unctrl
 
+from . import char_table
+
 
 
 ESCAPE_CHARS = {chr(curses.ascii.ESC), curses.ascii.ctrl('[')}
 DELETE_CHARS = {chr(curses.ascii.DEL), chr(curses.KEY_DC)}
 BACKSPACE_CHARS = {chr(curses.ascii.BS), chr(curses.KEY_BACKSPACE)}
+RESIZE_CHAR = chr(curses.KEY_RESIZE)
+
+_PRINTABLE_ASCII_PATTERN = re.compile(r"[\t -~]*")
 
 
 def is_printable_char(char):
-  return char == '\t' or not unicodedata.category(char).startswith("C")
+  return char_table.is_printable_char(char)
+
+
+def is_printable_string(string):
+  return _PRINTABLE_ASCII_PATTERN.fullmatch(string) is not None \
+         or char_table.is_printable_string(string)
@@ -0,0 +1,237 @@
+import codecs
+import collections
+import curses
+import os
+import select
+import signal
+import sys
+import termios
+import tty
+
+from . import attribute
+from . import console
+from . import misc
+
+
+
+# constants
+
+_TRUECOLOR_TERMS = {"truecolor", "24bit"}
+_ESCAPE = "\x1b"
+_ESCAPE_DELAY = 0.025 # in seconds
+_ESCAPE_SEQUENCE_TO_CHAR = {"\x1b[3~" : chr(curses.KEY_DC)}
+_COLOR_INDEX_MASK = curses.A_CHARTEXT | curses.A_COLOR
+_DECORATION_TO_SGR_PARAMETER = {
+  attribute.DecorationAttribute.bold : "1",
+  attribute.DecorationAttribute.dim : "2",
+  attribute.DecorationAttribute.underline : "4",
+  attribute.DecorationAttribute.blink : "5",
+  attribute.DecorationAttribute.reverse : "7",
+  attribute.DecorationAttribute.standout : "7",
+}
+
+
+
+# classes
+
+class TruecolorConsole(console.Console):
+  """
+  A console which writes escape sequences of 24-bit colors directly to a
+  terminal instead of using curses.
+  Colors of text are not matched with a palette but shown as they are.
+  """
+
+  def __init__(self, *args, **keyword_args):
+    super().__init__(*args, **keyword_args)
+    self._color_attrs = TruecolorAttribute(self._background_rgb)
+    self._input_fd = sys.stdin.fileno()
+    self._output = sys.stdout.buffer
+    self._output_strings = []
+    self._attr = None
+    self._decoder = codecs.getincrementaldecoder("UTF-8")("replace")
+    self._chars = collections.deque()
+
+  def turn_on(self):
+    self._terminal_attributes = termios.tcgetattr(self._input_fd)
+    tty.setcbreak(self._input_fd)
+    # A signal of resize interrupts waiting for keys through a pipe.
+    self._resize_fd, self._resize_notification_fd = os.pipe()
+    os.set_blocking(self._resize_notification_fd, False)
+    self._sigwinch_handler = signal.signal(signal.SIGWINCH,
+                                           self._notify_resize)
+    self._initialize_buffers(*self._get_screen_size())
+    self._write("\x1b[?1049h") # alternative screen
+    self._erase_screen()
+    self._update_screen()
+
+  def turn_off(self):
+    self._write("\x1b[0m\x1b[?1049l")
+    self._flush()
+    termios.tcsetattr(self._input_fd,
+                      termios.TCSADRAIN,
+                      self._terminal_attributes)
+    signal.signal(signal.SIGWINCH, self._sigwinch_handler)
+    os.close(self._resize_fd)
+    os.close(self._resize_notification_fd)
+
+  @property
+  def color_attrs(self):
+    return self._color_attrs
+
+  def _read_char(self, timeout=None):
+    while len(self._chars) == 0:
+      if timeout is not None and len(self._select(timeout)) == 0:
+        return None
+      string = self._read_string()
+      if string.startswith(_ESCAPE) and len(string) > 1:
+        # Escape sequences of keys except Delete are ignored.
+        if string in _ESCAPE_SEQUENCE_TO_CHAR:
+          self._chars.append(_ESCAPE_SEQUENCE_TO_CHAR[string])
+      else:
+        self._chars.extend(string)
+    return self._chars.popleft()
+
+  def _read_string(self):
+    string = self._read_available_string()
+    if string != _ESCAPE:
+      return string
+
+    # An escape key is distinguished from escape sequences by delay.
+    if not self._is_readable(_ESCAPE_DELAY):
+      return string
+    string += self._read_available_string()
+    while not self._is_escape_sequence_complete(string) \
+          and self._is_readable(_ESCAPE_DELAY):
+      string += self._read_available_string()
+    return string
+
+  def _read_available_string(self):
+    string = ""
+    while string == "":
+      if self._resize_fd in self._select(None):
+        os.read(self._resize_fd, 4096) # Signals so far are handled at once.
+        return misc.RESIZE_CHAR
+      string = self._decoder.decode(os.read(self._input_fd, 1))
+    return string
+
+  def _notify_resize(self, *_):
+    try:
+      os.write(self._resize_notification_fd, b"\0")
+    except BlockingIOError: # Notifications are already in the pipe.
+      pass
+
+  def _is_readable(self, timeout):
+    return len(select.select([self._input_fd], [], [], timeout)[0]) != 0
+
+  def _select(self, timeout):
+    """
+    Wait for keys or a resize and return file descriptors ready to be read.
+    """
+    return select.select([self._input_fd, self._resize_fd], [], [],
+                         timeout)[0]
+
+  @staticmethod
+  def _is_escape_sequence_complete(string):
+    if len(string) < 2:
+      return False
+    elif string[1] in "[O":
+      return len(string) > 2 and 0x40 <= ord(string[-1]) <= 0x7e
+    return True
+
+  def _get_screen_size(self):
+    return tuple(reversed(os.get_terminal_size(self._output.fileno())))
+
+  def _draw_cells(self, y, x, cells):
+    self._move(y, x)
+    for string, attr in cells:
+      if attr != self._attr:
+        self._write(self._color_attrs.to_sgr(attr))
+        self._attr = attr
+      self._write(string)
+
+  def _clear_row(self, y, x):
+    self._move(y, x)
+    self._reset_attr()
+    self._write("\x1b[K")
+
+  def _erase_screen(self):
+    self._reset_attr()
+    self._write("\x1b[2J")
+
+  def _scroll_screen(self, direction):
+    # Index at the bottom and reverse index at the top scroll a screen.
+    self._reset_attr()
+    if direction == "down":
+      self._move(self.screen_height - 1, 0)
+      self._write("\x1bD")
+    else:
+      self._move(0, 0)
+      self._write("\x1bM")
+
+  def _update_screen(self):
+    self._move(*self._cursor)
+    self._flush()
+
+  def _move(self, y, x):
+    self._write("\x1b[{};{}H".format(y + 1, x + 1))
+
+  def _reset_attr(self):
+    if self._attr != 0:
+      self._write("\x1b[0m")
+      self._attr = 0
+
+  def _write(self, string):
+    self._output_strings.append(string)
+
+  def _flush(self):
+    # Everything written since the last update is sent to a terminal at once.
+    self._output.write("".join(self._output_strings).encode("UTF-8"))
+    self._output.flush()
+    self._output_strings = []
+
+
+class TruecolorAttribute:
+  """
+  A table of exact colors for TruecolorConsole.
+  Their indices are put in the bits of attributes used by curses for
+  characters and color pairs, and the index 0 means a default color.
+  """
+
+  def __init__(self, background_rgb):
+    self._background_rgb = background_rgb
+    self._rgbs = [None]
+    self._rgb_to_attr = {}
+    self._attr_to_sgr = {}
+
+  def get_best_match(self, rgb):
+    assert attribute.ColorAttribute._is_valid_rgb(rgb)
+
+    # The same color as a background one is shown in a default color.
+    if rgb == self._background_rgb:
+      return 0
+
+    if rgb not in self._rgb_to_attr:
+      if len(self._rgbs) > _COLOR_INDEX_MASK:
+        return 0
+      self._rgb_to_attr[rgb] = len(self._rgbs)
+      self._rgbs.append(rgb)
+    return self._rgb_to_attr[rgb]
+
+  def to_sgr(self, attr):
+    if attr not in self._attr_to_sgr:
+      parameters = ["0"]
+      parameters.extend(sorted({parameter for decoration, parameter
+                                in _DECORATION_TO_SGR_PARAMETER.items()
+                                if attr & decoration}))
+      rgb = self._rgbs[attr & _COLOR_INDEX_MASK]
+      if rgb is not None:
+        parameters.append("38;2;{};{};{}".format(*rgb))
+      self._attr_to_sgr[attr] = "\x1b[{}m".format(";".join(parameters))
+    return self._attr_to_sgr[attr]
+
+
+
+# functions
+
+def is_truecolor_terminal():
+  return os.environ.get("COLORTERM") in _TRUECOLOR_TERMS
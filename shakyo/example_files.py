@@ -0,0 +1,282 @@
+import collections
+import functools
+import os
+import signal
+import threading
+
+from . import consolekit as ck
+from . import line_offset_index
+from . import pygments_util
+from . import sessions
+from . import source
+from . import text_to_lines
+from .path_to_x import path_to_filename
+
+
+
+# constants
+
+_GUESS_SIZE = 8 * 1024 # bytes or characters of text to guess its language
+_PREPROCESSED_FILES_AHEAD = 8 # after a file being read
+_WORKER_NICENESS = 10
+
+
+
+# classes
+
+FileCheckpoint = collections.namedtuple("FileCheckpoint",
+                                        ("file_index", "checkpoint"))
+
+
+class ExampleFiles:
+  """
+  Examples in files which are typed as one continuous sequence of lines
+  separated by blank lines.
+  Local files after the first one are lexed and highlighted into the line
+  cache in a pool of processes a few files ahead of the one being typed.
+  Lines of each file are indexed in the background once it is reached so
+  that lines can be located and found in it, unless a worker indexes it.
+  The pool is made when an instance is made so that its processes are
+  forked before a console is turned on and threads are started.
+  """
+
+  NOT_INDEXED = line_offset_index.NOT_INDEXED
+
+  def __init__(self, paths, sources, *, lexer_name=None):
+    assert len(paths) == len(sources) and len(paths) >= 1
+    self._paths = paths
+    self._sources = sources
+    self._lexer_name = lexer_name
+    self._lock = threading.Lock() # for lexers and results
+    self._lexers = {}
+    self._results = {}
+    self._line_indices = [line_offset_index.LineIndex(example_source)
+                          for example_source in sources]
+    self._preprocessed_indices = {
+        index for index, example_source in enumerate(sources)
+        if index > 0 and isinstance(example_source, source.FileSource)}
+    self._pool = None
+    if len(self._preprocessed_indices) > 0:
+      import multiprocessing # It is not needed for a single file.
+      self._pool = multiprocessing.Pool(
+          min(len(self._preprocessed_indices),
+              _PREPROCESSED_FILES_AHEAD,
+              max(1, (os.cpu_count() or 1) - 1)), # for a user interface
+          initializer=_initialize_worker)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *_):
+    self.close()
+
+  def close(self):
+    # Workers do not finish files no longer needed.
+    if self._pool is not None:
+      self._pool.terminate()
+      self._pool = None
+
+  def example_lines(self, console, *, style_name, colorize, decorate):
+    """
+    Return a function which returns an iterator of pairs of a checkpoint and
+    a line of all examples starting at a checkpoint like text_to_lines.
+    Iterators can be read by more than one thread at once.
+    """
+    attr_table = text_to_lines.AttrTable(console,
+                                         style_name=style_name,
+                                         colorize=colorize,
+                                         decorate=decorate)
+    self._preprocess_ahead(0, attr_table)
+    return functools.partial(self._lines, attr_table)
+
+  def position(self, checkpoint, number_of_lines):
+    """
+    Return the index of a file and the index of a line in it which is a
+    number of lines after a checkpoint given by example lines.
+    """
+    return (checkpoint.file_index,
+            checkpoint.checkpoint.line_index + number_of_lines)
+
+  def locate(self, file_index, line_index, number_of_previous_lines=0):
+    """
+    Return checkpoints of example lines before a line of a file with the
+    one of the chunk having it and a number of lines before it last, and
+    the number of lines from the last one to the line, or None if the file
+    has no line.
+    Files before it may have only some of their checkpoints.
+    """
+    checkpoints = self._line_index(file_index).checkpoints(
+        max(line_index - number_of_previous_lines, 0))
+    if len(checkpoints) == 0:
+      return None
+    number_of_lines = max(line_index - checkpoints[-1].line_index, 0)
+
+    file_checkpoints = self._checkpoints_before(file_index)
+    file_checkpoints.extend(
+        FileCheckpoint(file_index=file_index, checkpoint=checkpoint)
+        for checkpoint in checkpoints)
+    return file_checkpoints, number_of_lines
+
+  def find(self, string, file_index, line_index):
+    """
+    Return the indices of a file and a line of the first line having a
+    string from a line of a file, None if it is not found, or NOT_INDEXED
+    if lines to search are not indexed yet.
+    """
+    for index in range(file_index, len(self._sources)):
+      found_line_index = self._line_index(index).find(
+          string,
+          line_index if index == file_index else 0)
+      if found_line_index is self.NOT_INDEXED:
+        return self.NOT_INDEXED
+      if found_line_index is not None:
+        return index, found_line_index
+    return None
+
+  def load_session(self, number_of_previous_lines=0):
+    """
+    Return a location like locate() of the line where the last session
+    typing any of files stopped with the index of the first character of
+    the line on a screen in its raw line, or None if there is no session.
+    A file changed since then is resumed at the same line number.
+    An unchanged file is resumed at the checkpoint saved without waiting for
+    it to be indexed.
+    """
+    states = sessions.load_file_states(self._paths)
+    times_and_indices = [(state["time"], index)
+                         for index, state in enumerate(states)
+                         if state is not None]
+    if len(times_and_indices) == 0:
+      return None
+    _, file_index = max(times_and_indices)
+    state = states[file_index]
+
+    location = self.locate(file_index,
+                           state["line_index"],
+                           number_of_previous_lines)
+    if state["fingerprint"] != self._sources[file_index].fingerprint():
+      return None if location is None else location + (0,)
+
+    # The checkpoint saved is used while the file is not indexed to it yet.
+    checkpoints, number_of_lines = location or \
+                                   (self._checkpoints_before(file_index), 0)
+    checkpoint = FileCheckpoint(
+        file_index=file_index,
+        checkpoint=text_to_lines.Checkpoint(*state["checkpoint"]))
+    if location is None or checkpoint.checkpoint \
+       not in self._line_index(file_index).checkpoints():
+      checkpoints.append(checkpoint)
+      number_of_lines = state["line_index"] \
+                        - checkpoint.checkpoint.line_index
+    return checkpoints, number_of_lines, state["start"]
+
+  def save_session(self, position):
+    """
+    Save a position of the current line like one given by example lines as
+    a state of its file, forgetting states of the others.
+    States of all files are forgotten if position is None, e.g. after all
+    lines are typed, or if the file has no fingerprint.
+    """
+    states = [None] * len(self._paths)
+    if position is not None:
+      checkpoint, number_of_lines, start = position
+      fingerprint = self._sources[checkpoint.file_index].fingerprint()
+      if fingerprint is not None:
+        states[checkpoint.file_index] = {
+          "fingerprint" : fingerprint,
+          "line_index" : checkpoint.checkpoint.line_index + number_of_lines,
+          "start" : start,
+          "checkpoint" : list(checkpoint.checkpoint),
+        }
+    sessions.save_file_states(self._paths, states)
+
+  def _lines(self, attr_table, checkpoint=None):
+    checkpoint = checkpoint or FileCheckpoint(file_index=0, checkpoint=None)
+    has_lines = False
+
+    for index in range(checkpoint.file_index, len(self._sources)):
+      self._preprocess_ahead(index, attr_table)
+      self._line_index(index) # Indexing starts once a file is reached.
+      file_checkpoint = checkpoint.checkpoint \
+                        if index == checkpoint.file_index else None
+      for line_index, (line_checkpoint, line) in enumerate(
+          text_to_lines.highlight_lines(self._sources[index],
+                                        self._lexer(index),
+                                        attr_table,
+                                        checkpoint=file_checkpoint)):
+        # A separator is not a part of any file not to be made again when
+        # lines are made again from the first checkpoint of a file.
+        if line_index == 0 and has_lines:
+          yield None, ck.Line()
+        has_lines = True
+        yield (None if line_checkpoint is None else
+               FileCheckpoint(file_index=index,
+                              checkpoint=line_checkpoint)), line
+
+  def _preprocess_ahead(self, file_index, attr_table):
+    if self._pool is None: return
+    with self._lock:
+      for index in range(file_index + 1,
+                         min(file_index + _PREPROCESSED_FILES_AHEAD + 1,
+                             len(self._sources))):
+        if index in self._preprocessed_indices \
+           and index not in self._results:
+          self._results[index] = self._pool.apply_async(
+              _preprocess,
+              (self._paths[index], self._lexer_name, attr_table))
+
+  def _checkpoints_before(self, file_index):
+    return [FileCheckpoint(file_index=index, checkpoint=checkpoint)
+            for index in range(file_index)
+            for checkpoint in self._line_index(index).checkpoints()]
+
+  def _line_index(self, index):
+    """
+    Return the index of lines of a file loading or building it, except
+    while a worker builds it.
+    """
+    with self._lock:
+      result = self._results.get(index)
+    line_index = self._line_indices[index]
+    line_index.start(build=result is None or result.ready())
+    return line_index
+
+  def _lexer(self, index):
+    with self._lock:
+      if index not in self._lexers:
+        result = self._results.get(index)
+        if result is not None and result.ready() and result.successful():
+          self._lexers[index] = result.get()
+        else:
+          self._lexers[index] = _guess_lexer(self._paths[index],
+                                             self._sources[index],
+                                             self._lexer_name)
+      return self._lexers[index]
+
+
+
+# functions
+
+def _guess_lexer(path, example_source, lexer_name):
+  return pygments_util.guess_lexer(lexer_name=lexer_name,
+                                   filename=path_to_filename(path),
+                                   text=example_source.head(_GUESS_SIZE))
+
+
+def _initialize_worker():
+  # Keys typed by a user are not interrupted by workers.
+  signal.signal(signal.SIGINT, signal.SIG_IGN)
+  os.nice(_WORKER_NICENESS)
+
+
+def _preprocess(path, lexer_name, attr_table):
+  """
+  Guess a language of a file and write its highlighted lines to the line
+  cache and its index in a worker process.
+  """
+  example_source = source.FileSource(path)
+  lexer = _guess_lexer(path, example_source, lexer_name)
+  for _ in text_to_lines.highlight_lines(example_source, lexer, attr_table):
+    pass
+  line_offset_index.LineIndex(example_source).build()
+  return lexer
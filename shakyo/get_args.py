@@ -15,12 +15,16 @@ _DESCRIPTION = "{} is a tool to learn about something just by typing it. " \
                "To play with it, just type letters on a cursor. " \
                "Type {} to scroll down and {} to scroll up one line, " \
                "{} to scroll down and {} to scroll up one page, " \
+               "{} to go to a line, {} to search for a string " \
+               "incrementally and again for the next one, " \
                "and Esc or ^[ to exit while running it." \
                .format(config.COMMAND_NAME,
                        ck.unctrl(config.SCROLL_DOWN_CHAR),
                        ck.unctrl(config.SCROLL_UP_CHAR),
                        ck.unctrl(config.PAGE_DOWN_CHAR),
-                       ck.unctrl(config.PAGE_UP_CHAR))
+                       ck.unctrl(config.PAGE_UP_CHAR),
+                       ck.unctrl(config.GOTO_LINE_CHAR),
+                       ck.unctrl(config.SEARCH_CHAR))
 _SHOW_LANGUAGES_OPTION = "--show-languages"
 _SHOW_STYLES_OPTION = "--show-styles"
 
@@ -31,8 +35,11 @@ _SHOW_STYLES_OPTION = "--show-styles"
 def get_args():
   arg_parser = argparse.ArgumentParser(description=_DESCRIPTION)
 
-  arg_parser.add_argument("example_path", nargs='?', default=None,
-                          help="file path or URI to an example")
+  arg_parser.add_argument("example_paths", metavar="example_path",
+                          nargs='*',
+                          help="file path, directory, glob pattern or URI "
+                               "to examples typed one after another "
+                               "(default: stdin)")
   arg_parser.add_argument("-a", "--asciize",
                           dest="asciize", action="store_true",
                           help="enable asciization of unicode characters")
@@ -52,9 +59,27 @@ def get_args():
   arg_parser.add_argument("-l", "--language", metavar="LANGUAGE",
                           dest="lexer_name", type=str, default=None,
                           help="specify a language of an example")
+  arg_parser.add_argument("--max-fps", metavar="FPS",
+                          dest="max_fps", type=int, default=60,
+                          help="limit screen updates per second while keys "
+                               "are typed fast or pasted"
+                               + _DEFAULT_ARGUMENT_HELP)
   arg_parser.add_argument(_SHOW_LANGUAGES_OPTION,
                           dest="show_languages", action="store_true",
                           help="show all lauguages available for examples")
+  arg_parser.add_argument("--no-resume",
+                          dest="resume", action="store_false",
+                          help="start at the beginning of examples instead "
+                               "of the line where the last session typing "
+                               "them stopped")
+  arg_parser.add_argument("-p", "--perceptual-colors",
+                          dest="perceptual_colors", action="store_true",
+                          help="match colors of text with the ones of your "
+                               "terminal by perceptual color difference")
+  arg_parser.add_argument("--profile", metavar="PROFILE_FILE",
+                          dest="profile_file", default=None,
+                          help="write a profile of a session by cProfile "
+                               "to a file on exit")
   arg_parser.add_argument("-s", "--style",
                           dest="style_name", type=str, default="default",
                           help="specify a style name" + _DEFAULT_ARGUMENT_HELP)
@@ -65,6 +90,13 @@ def get_args():
                           dest="spaces_per_tab", type=int, default=4,
                           help="set number of spaces per tab"
                                + _DEFAULT_ARGUMENT_HELP)
+  arg_parser.add_argument("--trace-latency",
+                          dest="trace_latency", action="store_true",
+                          help="show latency per key by stage on exit")
+  arg_parser.add_argument("--trace-file", metavar="TRACE_FILE",
+                          dest="trace_file", default=None,
+                          help="write latency per key by stage to a file "
+                               "in the Chrome trace event format on exit")
   arg_parser.add_argument("-v", "--version",
                           dest="show_version", action="store_true",
                           help="show version information")
@@ -95,6 +127,8 @@ def get_args():
 def _check_args(args):
   if args.spaces_per_tab <= 0:
     log.error("Number of spaces per tab must be greater than 0.")
+  elif args.max_fps <= 0:
+    log.error("Maximum FPS must be greater than 0.")
   elif args.lexer_name is not None \
        and args.lexer_name not in pygments_util.all_lexer_names():
     log.error("The language, \"{}\" is not available for examples. "
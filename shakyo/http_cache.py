@@ -0,0 +1,414 @@
+import fcntl
+import functools
+import hashlib
+import http.client
+import json
+import os
+import os.path
+import threading
+import urllib.parse
+
+from . import config
+from . import log
+from . import source
+
+
+
+# constants
+
+SUPPORTED_SCHEMES = {"http", "https"}
+_DIRECTORY = os.path.join(config.CACHE_DIRECTORY, "http")
+_MAX_DIRECTORY_SIZE = 256 * 1024 * 1024 # bytes
+_TIMEOUT = 10 # seconds
+_MAX_REDIRECTS = 5
+_REDIRECT_STATUSES = {301, 302, 303, 307, 308}
+_USER_AGENT = "{}/{}".format(config.COMMAND_NAME, config.VERSION)
+_BODY_EXTENSION = ".body"
+_PART_EXTENSION = ".part"
+_METADATA_EXTENSION = ".json"
+_ENCODING = "UTF-8"
+
+
+
+# classes
+
+class HttpError(Exception):
+  pass
+
+
+class _ConnectionPool:
+  """
+  A pool of idle HTTP connections by hosts which are reused by requests
+  after their responses are read to their ends.
+  """
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._connections = {}
+
+  def get(self, scheme, netloc):
+    with self._lock:
+      connections = self._connections.get((scheme, netloc), [])
+      if len(connections) != 0:
+        return connections.pop(), True
+
+    connection_class = http.client.HTTPSConnection if scheme == "https" \
+                       else http.client.HTTPConnection
+    return connection_class(netloc, timeout=_TIMEOUT), False
+
+  def put(self, scheme, netloc, connection):
+    with self._lock:
+      self._connections.setdefault((scheme, netloc), []).append(connection)
+
+
+class _Response:
+  """
+  A response whose connection is given back to a pool when its body is
+  read to the end.
+  """
+
+  def __init__(self, response, release):
+    self._response = response
+    self._release = release
+
+  def __getattr__(self, name):
+    return getattr(self._response, name)
+
+  def read1(self, size):
+    try:
+      chunk = self._response.read1(size)
+    except http.client.HTTPException as exception: # e.g. IncompleteRead
+      raise OSError(exception) from exception
+
+    if len(chunk) == 0 and size > 0:
+      # A connection closed in the middle of a body is not its end.
+      if self._response.length not in {None, 0}:
+        raise OSError("Connection closed before the end of a body")
+      self._response.close() # Its connection is kept open.
+      if self._release is not None:
+        self._release()
+        self._release = None
+    return chunk
+
+  def read(self, size=-1):
+    chunks = []
+    while size < 0 or sum(map(len, chunks)) < size:
+      chunk = self.read1(64 * 1024 if size < 0
+                         else size - sum(map(len, chunks)))
+      if len(chunk) == 0: break
+      chunks.append(chunk)
+    return b"".join(chunks)
+
+  def close(self):
+    self._response.close()
+
+
+class _CachingStream:
+  """
+  A stream of a response body which is also appended to a partial file in
+  the cache.
+  The partial file becomes a complete one when the body is read to its end.
+  When a download is resumed, bytes already in the partial file are read
+  first.
+  """
+
+  def __init__(self, response, paths, part_file, prefix_size=0):
+    self._response = response
+    self._paths = paths
+    self._part_file = part_file
+    self._prefix_file = open(paths.part, "rb") if prefix_size > 0 else None
+    self._prefix_size = prefix_size
+
+  def read1(self, size):
+    if self._prefix_size > 0:
+      chunk = self._prefix_file.read(min(size, self._prefix_size))
+      self._prefix_size -= len(chunk)
+      if len(chunk) != 0:
+        return chunk
+
+    chunk = self._response.read1(size)
+    if len(chunk) == 0:
+      self._complete()
+    else:
+      self._write(chunk)
+    return chunk
+
+  def close(self):
+    self._response.close()
+    for file in [self._part_file, self._prefix_file]:
+      if file is not None:
+        file.close()
+    self._part_file = self._prefix_file = None
+
+  def _write(self, chunk):
+    if self._part_file is None: return
+    try:
+      self._part_file.write(chunk)
+    except OSError: # The cache is given up but the stream continues.
+      self._close_part_file()
+
+  def _complete(self):
+    if self._part_file is None: return
+    try:
+      self._part_file.flush()
+      os.replace(self._paths.part, self._paths.body)
+    except OSError:
+      pass
+    self._close_part_file()
+
+  def _close_part_file(self):
+    if self._part_file is not None:
+      self._part_file.close()
+      self._part_file = None
+
+
+class _Paths:
+  def __init__(self, uri):
+    key = hashlib.sha1(uri.encode(_ENCODING)).hexdigest()
+    self.body = os.path.join(_DIRECTORY, key + _BODY_EXTENSION)
+    self.part = os.path.join(_DIRECTORY, key + _PART_EXTENSION)
+    self.metadata = os.path.join(_DIRECTORY, key + _METADATA_EXTENSION)
+
+
+
+# functions
+
+def open_uri(uri):
+  """
+  Open a source of a remote file through an HTTP cache.
+  A cached file is validated by its ETag or Last-Modified header, a
+  partially downloaded file is resumed by a range request, and a body
+  being downloaded is streamed while it is written to the cache.
+  A cached file is used when a server is not available.
+  """
+  paths = _Paths(uri)
+  metadata = _load_metadata(paths, uri)
+
+  part_file = _open_part_file(paths)
+  prefix_size = 0
+  headers = {"User-Agent" : _USER_AGENT}
+  if metadata is not None and os.path.exists(paths.body):
+    headers.update(_conditional_headers(metadata))
+  elif metadata is not None and part_file is not None \
+       and _validator(metadata) is not None:
+    prefix_size = os.fstat(part_file.fileno()).st_size
+    if prefix_size > 0:
+      headers["Range"] = "bytes={}-".format(prefix_size)
+      headers["If-Range"] = _validator(metadata)
+
+  try:
+    response = _request(uri, headers)
+  except (OSError, http.client.HTTPException) as exception:
+    if metadata is None or not os.path.exists(paths.body):
+      raise
+    log.message("{} (using a cached page)".format(exception))
+    response = None
+
+  if prefix_size > 0 and not _is_resumed(response, prefix_size):
+    if response.status == 416 \
+       and _complete_size(response) == prefix_size:
+      # The partial file was complete but not renamed.
+      response.read()
+      try:
+        os.replace(paths.part, paths.body)
+      except OSError:
+        pass
+      else:
+        _close(part_file)
+        return _open_cached_body(paths)
+    prefix_size = 0
+    # A whole body given when the file has changed replaces the partial
+    # one, and otherwise it is requested again not to resume a wrong range.
+    if response.status != 200:
+      response.close()
+      del headers["Range"], headers["If-Range"]
+      response = _request(uri, headers)
+
+  if response is None or response.status == 304:
+    if response is not None:
+      response.read()
+    _close(part_file)
+    return _open_cached_body(paths)
+  elif response.status >= 400:
+    _close(part_file)
+    raise HttpError("HTTP Error {}: {}".format(response.status,
+                                               response.reason))
+  elif prefix_size > 0:
+    return source.StreamSource(
+        _CachingStream(response, paths, part_file, prefix_size))
+  elif response.status != 200:
+    _close(part_file)
+    raise HttpError("HTTP Error {}: {}".format(response.status,
+                                               response.reason))
+
+  metadata = {"uri" : uri,
+              "etag" : response.getheader("ETag"),
+              "last_modified" : response.getheader("Last-Modified")}
+  if part_file is None \
+     or _validator(metadata) is None \
+     or "no-store" in (response.getheader("Cache-Control") or ""):
+    _close(part_file)
+    return source.StreamSource(response)
+
+  try:
+    # An old body is removed not to be validated by new metadata.
+    if os.path.exists(paths.body):
+      os.remove(paths.body)
+    part_file.truncate(0)
+    _save_metadata(paths, metadata)
+  except OSError:
+    _close(part_file)
+    return source.StreamSource(response)
+  return source.StreamSource(_CachingStream(response, paths, part_file))
+
+
+def _is_resumed(response, prefix_size):
+  return response.status == 206 \
+         and (response.getheader("Content-Range") or "") \
+             .startswith("bytes {}-".format(prefix_size))
+
+
+def _complete_size(response):
+  """
+  Return the size of a whole body in Content-Range of a response to a
+  range request which is not satisfiable, or None if it is unknown.
+  """
+  content_range = response.getheader("Content-Range") or ""
+  if not content_range.startswith("bytes */"):
+    return None
+  try:
+    return int(content_range[len("bytes */"):])
+  except ValueError:
+    return None
+
+
+def _request(uri, headers):
+  """
+  Send a GET request following redirects and return its response.
+  A reused connection closed by a server is opened again once.
+  """
+  for _ in range(_MAX_REDIRECTS + 1):
+    parts = urllib.parse.urlsplit(uri)
+    if parts.scheme not in SUPPORTED_SCHEMES:
+      raise HttpError("Unsupported scheme of URI: {}".format(uri))
+    path = urllib.parse.urlunsplit(("", "", parts.path or "/", parts.query, ""))
+
+    while True:
+      connection, is_reused = _connection_pool().get(parts.scheme,
+                                                     parts.netloc)
+      try:
+        connection.request("GET", path, headers=headers)
+        raw_response = connection.getresponse()
+        break
+      except (http.client.RemoteDisconnected,
+              ConnectionResetError,
+              BrokenPipeError):
+        connection.close()
+        if not is_reused:
+          raise
+
+    response = _Response(raw_response,
+                         functools.partial(_connection_pool().put,
+                                           parts.scheme,
+                                           parts.netloc,
+                                           connection))
+    location = response.getheader("Location")
+    if response.status not in _REDIRECT_STATUSES or location is None:
+      return response
+    response.read()
+    uri = urllib.parse.urljoin(uri, location)
+
+  raise HttpError("Too many redirects")
+
+
+@functools.lru_cache(maxsize=None)
+def _connection_pool():
+  return _ConnectionPool()
+
+
+def _open_part_file(paths):
+  """
+  Open and lock a partial file, or return None if it is not available or
+  used by another process.
+  """
+  try:
+    os.makedirs(_DIRECTORY, exist_ok=True)
+    _evict_files(exception_paths={paths.body, paths.part, paths.metadata})
+    part_file = open(paths.part, "ab")
+  except OSError:
+    return None
+
+  try:
+    fcntl.flock(part_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+  except OSError:
+    part_file.close()
+    return None
+  return part_file
+
+
+def _open_cached_body(paths):
+  os.utime(paths.body) # used as the time of last access for LRU eviction
+  return source.FileSource(paths.body)
+
+
+def _close(file):
+  if file is not None:
+    file.close()
+
+
+def _validator(metadata):
+  return metadata.get("etag") or metadata.get("last_modified")
+
+
+def _conditional_headers(metadata):
+  headers = {}
+  if metadata.get("etag") is not None:
+    headers["If-None-Match"] = metadata["etag"]
+  if metadata.get("last_modified") is not None:
+    headers["If-Modified-Since"] = metadata["last_modified"]
+  return headers
+
+
+def _load_metadata(paths, uri):
+  try:
+    with open(paths.metadata) as f:
+      metadata = json.load(f)
+  except (OSError, ValueError):
+    return None
+  return metadata if metadata.get("uri") == uri else None
+
+
+def _save_metadata(paths, metadata):
+  temporary_path = "{}.{}".format(paths.metadata, os.getpid())
+  with open(temporary_path, "w") as f:
+    json.dump(metadata, f)
+  os.replace(temporary_path, paths.metadata)
+
+
+def _evict_files(exception_paths):
+  """
+  Remove bodies and partial files from the least recently used one while
+  the directory is larger than its limit, and metadata of files removed.
+  """
+  paths = [os.path.join(_DIRECTORY, filename)
+           for filename in os.listdir(_DIRECTORY)
+           if filename.endswith((_BODY_EXTENSION, _PART_EXTENSION))]
+  metadata_paths = [os.path.join(_DIRECTORY, filename)
+                    for filename in os.listdir(_DIRECTORY)
+                    if filename.endswith(_METADATA_EXTENSION)]
+  stats = {path: os.stat(path) for path in paths + metadata_paths}
+  size = sum(stat.st_size for stat in stats.values())
+
+  for path in sorted(paths, key=lambda path: stats[path].st_mtime):
+    if size <= _MAX_DIRECTORY_SIZE: break
+    if path in exception_paths: continue
+    os.remove(path)
+    size -= stats[path].st_size
+    paths.remove(path)
+
+  keys = {os.path.splitext(path)[0] for path in paths}
+  for path in metadata_paths:
+    if os.path.splitext(path)[0] not in keys \
+       and path not in exception_paths:
+      os.remove(path)
+
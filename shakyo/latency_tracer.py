@@ -0,0 +1,127 @@
+import bisect
+import contextlib
+import json
+import os
+import threading
+import time
+
+
+
+# constants
+
+_BUCKET_BOUNDARIES = [0.0001, 0.0003, 0.001, 0.003, 0.01, 0.03, 0.1, 0.3]
+_PERCENTILES = [50, 90, 99, 100]
+_TOTAL_STAGE = "total"
+_MAX_BAR_LENGTH = 40
+
+
+
+# classes
+
+class LatencyTracer:
+  """
+  A recorder of time taken by stages of each iteration of a loop handling
+  keys.
+  Stages can be nested and their own times exclude the ones of stages
+  in them.
+  """
+
+  def __init__(self):
+    self._events = [] # (name, start time, duration, thread ID)
+    self._self_times = {}
+    self._stack = []
+    self._iteration_time = 0
+
+  @contextlib.contextmanager
+  def stage(self, name):
+    start_time = time.perf_counter()
+    self._stack.append(0) # total time of child stages
+    try:
+      yield
+    finally:
+      duration = time.perf_counter() - start_time
+      child_time = self._stack.pop()
+      if len(self._stack) == 0:
+        self._iteration_time += duration
+      else:
+        self._stack[-1] += duration
+      self._self_times.setdefault(name, []).append(duration - child_time)
+      self._events.append((name, start_time, duration, threading.get_ident()))
+
+  def end_iteration(self):
+    self._self_times.setdefault(_TOTAL_STAGE, []) \
+                    .append(self._iteration_time)
+    self._iteration_time = 0
+
+  def write_summary(self, file):
+    """
+    Write percentiles of time taken by each stage and a histogram of time
+    taken by whole iterations.
+    """
+    print("latency per key in milliseconds:", file=file)
+    print("{:>10} {:>8}".format("stage", "count")
+          + "".join(" {:>8}".format("p{}".format(percentile))
+                    for percentile in _PERCENTILES),
+          file=file)
+    for name, times in sorted(self._self_times.items(),
+                              key=lambda item: item[0] == _TOTAL_STAGE):
+      times = sorted(times)
+      print("{:>10} {:>8}".format(name, len(times))
+            + "".join(" {:8.3f}".format(_percentile(times, percentile) * 1000)
+                      for percentile in _PERCENTILES),
+            file=file)
+
+    counts = [0] * (len(_BUCKET_BOUNDARIES) + 1)
+    for iteration_time in self._self_times.get(_TOTAL_STAGE, []):
+      counts[bisect.bisect_right(_BUCKET_BOUNDARIES, iteration_time)] += 1
+
+    print("histogram of total latency:", file=file)
+    labels = ["< {:g} ms".format(boundary * 1000)
+              for boundary in _BUCKET_BOUNDARIES] \
+             + [">= {:g} ms".format(_BUCKET_BOUNDARIES[-1] * 1000)]
+    for label, count in zip(labels, counts):
+      print("{:>10} | {} {}"
+            .format(label,
+                    "#" * (_MAX_BAR_LENGTH * count // max(max(counts), 1)),
+                    count),
+            file=file)
+
+  def write_chrome_trace(self, filename):
+    """
+    Write events in the trace event format which can be viewed by
+    chrome://tracing or Perfetto.
+    """
+    with open(filename, "w") as f:
+      json.dump({"traceEvents" : [{"name" : name,
+                                   "ph" : "X",
+                                   "ts" : start_time * 1000000,
+                                   "dur" : duration * 1000000,
+                                   "pid" : os.getpid(),
+                                   "tid" : thread_id}
+                                  for name, start_time, duration, thread_id
+                                  in self._events],
+                 "displayTimeUnit" : "ms"},
+                f)
+
+
+class NullLatencyTracer:
+  """
+  A latency tracer which records nothing.
+  """
+
+  @contextlib.contextmanager
+  def stage(self, name):
+    yield
+
+  def end_iteration(self):
+    pass
+
+
+
+# functions
+
+def _percentile(sorted_numbers, percentile):
+  if len(sorted_numbers) == 0:
+    return 0
+  return sorted_numbers[min(len(sorted_numbers) * percentile // 100,
+                            len(sorted_numbers) - 1)]
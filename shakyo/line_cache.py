@@ -0,0 +1,257 @@
+import array
+import bisect
+import contextlib
+import fcntl
+import functools
+import hashlib
+import itertools
+import os
+import os.path
+import struct
+import threading
+
+from . import config
+from . import consolekit as ck
+
+
+
+# constants
+
+_FORMAT_VERSION = 2
+_FILE_EXTENSION = ".lines"
+_MAX_DIRECTORY_SIZE = 256 * 1024 * 1024 # bytes
+_CHUNK_HEADER = struct.Struct("<QQIIBQQ") # line index, offset, lines,
+                                          # body size, flags, and line index
+                                          # and offset of the next chunk
+_NEXT_RESTARTABLE = 1 # Lexing can restart at the next chunk.
+_LAST = 2 # A chunk is the last one of text.
+_LINE_HEADER = struct.Struct("<II") # string size, attribute runs
+_ENCODING = "UTF-8"
+
+
+
+# classes
+
+class LineCache:
+  """
+  An append-only file of chunks of highlighted lines.
+  Every chunk is stored with the checkpoint it starts at so that chunks
+  can be read from any of them, and with the checkpoint of the next chunk
+  and if lexing can restart at it.
+  Broken chunks at the end of a file are discarded when it is opened.
+  Files are locked while they are written so that processes can share them,
+  and chunks appended by other processes are indexed when they are looked
+  for.
+  """
+
+  def __init__(self, path):
+    self._lock = threading.Lock()
+    self._file = open(path, "a+b")
+    self._checkpoints = {}
+    self._restart_checkpoints = []
+    self._positions = []
+    self._end = 0
+    self._next_checkpoint = None
+    self._is_complete = False
+    with self._file_lock():
+      self._load_index()
+    os.utime(path) # used as the time of last access for LRU eviction
+
+  def __len__(self):
+    with self._lock:
+      self._update_index()
+      return len(self._positions)
+
+  def find(self, checkpoint):
+    with self._lock:
+      self._update_index()
+      return self._checkpoints.get(tuple(checkpoint))
+
+  def restart_checkpoint(self, line_index):
+    """
+    Return the last checkpoint at or before a line at which lexing can
+    restart, or None if there is no such checkpoint but the beginning.
+    """
+    with self._lock:
+      self._update_index()
+      index = bisect.bisect(self._restart_checkpoints, (line_index + 1,))
+      return None if index == 0 else self._restart_checkpoints[index - 1]
+
+  def chunks(self, chunk_index):
+    """
+    Give triples of a checkpoint, lines and the checkpoint of the next
+    chunk, which is None after the last chunk of text.
+    """
+    while True:
+      with self._lock:
+        if chunk_index >= len(self._positions):
+          self._update_index()
+        if chunk_index >= len(self._positions): return
+        position = self._positions[chunk_index]
+      yield self._read_chunk(position)
+      chunk_index += 1
+
+  def append(self,
+             checkpoint,
+             lines,
+             next_checkpoint=None,
+             is_next_restartable=False,
+             is_first=False):
+    """
+    Append a chunk only if it is the next one of the last one, or if it is
+    the first chunk of text.
+    next_checkpoint is None if the chunk is the last one of text.
+    """
+    with self._lock:
+      self._update_index()
+      if self._is_complete \
+         or (not is_first if len(self._positions) == 0 else
+             tuple(checkpoint) != self._next_checkpoint) \
+         or self._end > _MAX_DIRECTORY_SIZE // 2:
+        return
+
+      body = b"".join(_encode_line(line) for line in lines)
+      header = _CHUNK_HEADER.pack(
+          checkpoint.line_index,
+          checkpoint.offset,
+          len(lines),
+          len(body),
+          (_NEXT_RESTARTABLE if is_next_restartable else 0)
+          | (_LAST if next_checkpoint is None else 0),
+          *(next_checkpoint or (0, 0)))
+      try:
+        with self._file_lock():
+          # Chunks can be appended by another process in the meantime.
+          if os.fstat(self._file.fileno()).st_size != self._end:
+            return
+          self._file.write(header)
+          self._file.write(body)
+          self._file.flush()
+      except OSError:
+        return
+      self._add_chunk(header)
+
+  def _update_index(self):
+    try:
+      if os.fstat(self._file.fileno()).st_size != self._end:
+        with self._file_lock():
+          self._load_index()
+    except OSError:
+      pass
+
+  def _load_index(self):
+    size = os.fstat(self._file.fileno()).st_size
+    while self._end + _CHUNK_HEADER.size <= size:
+      header = os.pread(self._file.fileno(), _CHUNK_HEADER.size, self._end)
+      if self._end + _CHUNK_HEADER.size + _CHUNK_HEADER.unpack(header)[3] \
+         > size:
+        break
+      self._add_chunk(header)
+
+    if self._end != size:
+      self._file.truncate(self._end)
+
+  def _add_chunk(self, header):
+    line_index, offset, _, body_size, flags, next_line_index, next_offset \
+        = _CHUNK_HEADER.unpack(header)
+    self._checkpoints[(line_index, offset)] = len(self._positions)
+    self._positions.append(self._end)
+    self._end += _CHUNK_HEADER.size + body_size
+    self._next_checkpoint = (next_line_index, next_offset)
+    if flags & _NEXT_RESTARTABLE:
+      self._restart_checkpoints.append(self._next_checkpoint)
+    self._is_complete = flags & _LAST != 0
+
+  @contextlib.contextmanager
+  def _file_lock(self):
+    fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+    try:
+      yield
+    finally:
+      fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+  def _read_chunk(self, position):
+    line_index, offset, number_of_lines, body_size, flags, next_line_index, \
+        next_offset = _CHUNK_HEADER.unpack(
+            os.pread(self._file.fileno(), _CHUNK_HEADER.size, position))
+    body = memoryview(os.pread(self._file.fileno(),
+                               body_size,
+                               position + _CHUNK_HEADER.size))
+
+    lines = []
+    position = 0
+    for _ in range(number_of_lines):
+      line, position = _decode_line(body, position)
+      lines.append(line)
+    return (line_index, offset), lines, \
+           None if flags & _LAST else (next_line_index, next_offset)
+
+
+
+# functions
+
+def make_key(*parts):
+  return hashlib.sha1(repr((_FORMAT_VERSION,) + parts).encode(_ENCODING)) \
+         .hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def open_line_cache(key):
+  """
+  Open a cache of lines in the cache directory, or return None if it is not
+  available.
+  Caches are evicted when the first one is opened in a process.
+  """
+  try:
+    os.makedirs(config.CACHE_DIRECTORY, exist_ok=True)
+    line_cache = LineCache(os.path.join(config.CACHE_DIRECTORY,
+                                        key + _FILE_EXTENSION))
+    _evict_line_caches()
+    return line_cache
+  except OSError:
+    return None
+
+
+@functools.lru_cache(maxsize=None)
+def _evict_line_caches():
+  """
+  Remove caches from the least recently used one while the directory is
+  larger than its limit.
+  A cache just opened is the most recently used one and is never removed as
+  a cache is at most half as large as the limit.
+  """
+  paths = [os.path.join(config.CACHE_DIRECTORY, filename)
+           for filename in os.listdir(config.CACHE_DIRECTORY)
+           if filename.endswith(_FILE_EXTENSION)]
+  stats = {path: os.stat(path) for path in paths}
+  size = sum(stat.st_size for stat in stats.values())
+
+  for path in sorted(paths, key=lambda path: stats[path].st_mtime):
+    if size <= _MAX_DIRECTORY_SIZE: break
+    os.remove(path)
+    size -= stats[path].st_size
+
+
+def _encode_line(line):
+  string = str(line).encode(_ENCODING)
+  runs = array.array("I")
+  for attr, attrs in itertools.groupby(line.attrs):
+    runs.extend((sum(1 for _ in attrs), attr))
+  return _LINE_HEADER.pack(len(string), len(runs) // 2) \
+         + string + runs.tobytes()
+
+
+def _decode_line(body, position):
+  string_size, number_of_runs = _LINE_HEADER.unpack_from(body, position)
+  position += _LINE_HEADER.size
+  string = bytes(body[position:position + string_size]).decode(_ENCODING)
+  position += string_size
+
+  runs = array.array("I")
+  runs.frombytes(body[position:position + number_of_runs * 2 * runs.itemsize])
+  position += number_of_runs * 2 * runs.itemsize
+
+  attrs = array.array("I")
+  for index in range(0, len(runs), 2):
+    attrs.extend(array.array("I", [runs[index + 1]]) * runs[index])
+  return ck.Line.from_string(string, attrs), position
@@ -0,0 +1,232 @@
+import array
+import bisect
+import hashlib
+import os
+import os.path
+import struct
+import threading
+
+from . import config
+from . import text_to_lines
+
+
+
+# constants
+
+_FORMAT_VERSION = 1
+_FILE_EXTENSION = ".index"
+_MAX_DIRECTORY_SIZE = 16 * 1024 * 1024 # bytes
+_HEADER = struct.Struct("<Q") # number of checkpoints
+_ENCODING = "UTF-8"
+NOT_INDEXED = object() # given by searches in lines not indexed yet
+
+
+
+# classes
+
+class LineIndex:
+  """
+  A sparse index of lines of a source by checkpoints which text_to_lines
+  gives with chunks of them, built by a background thread.
+  A line is found by binary search from the checkpoint of the chunk having
+  it, so that only lines around it are read, lexed and folded.
+  A complete index of a source with a fingerprint is saved next to the
+  line cache and loaded instead of being built again.
+  Lines not indexed yet are never waited for.
+  """
+
+  def __init__(self, source):
+    self._source = source
+    self._condition = threading.Condition()
+    self._line_indices = array.array("Q")
+    self._offsets = array.array("Q")
+    self._is_complete = False
+    self._is_started = False
+
+  def start(self, build=True):
+    """
+    Load a saved index, or build it in a background thread unless build is
+    False, e.g. while another process builds and saves it.
+    """
+    with self._condition:
+      if self._is_started: return
+    if self._load() or not build: return
+
+    with self._condition:
+      if self._is_started: return
+      self._is_started = True
+    threading.Thread(target=self.build, daemon=True).start()
+
+  def build(self):
+    if self._load(): return
+
+    for checkpoint in text_to_lines.chunk_checkpoints(self._source):
+      with self._condition:
+        self._line_indices.append(checkpoint.line_index)
+        self._offsets.append(checkpoint.offset)
+        self._condition.notify_all()
+
+    with self._condition:
+      self._is_complete = True
+      self._condition.notify_all()
+    self._save()
+
+  def checkpoints(self, line_index=None):
+    """
+    Return checkpoints of chunks before a line and the one of the chunk
+    having it, or all checkpoints indexed so far without line_index.
+    Checkpoints indexed so far are returned for a line not indexed yet.
+    """
+    with self._condition:
+      if line_index is None:
+        number = len(self._line_indices)
+      else:
+        # Blank lines at the beginning are not in any chunk.
+        number = max(bisect.bisect_right(self._line_indices, line_index),
+                     min(len(self._line_indices), 1))
+      return [text_to_lines.Checkpoint(line_index=index, offset=offset)
+              for index, offset in zip(self._line_indices[:number],
+                                       self._offsets[:number])]
+
+  def find(self, string, line_index):
+    """
+    Return the index of the first line having a string from a line, None
+    if it is not found, or NOT_INDEXED if lines are not indexed or read
+    far enough yet.
+    Buffers of sources are searched at once if they can be.
+    """
+    with self._condition:
+      if not self._is_complete \
+         and (len(self._line_indices) == 0
+              or self._line_indices[-1] <= line_index):
+        return NOT_INDEXED
+    checkpoints = self.checkpoints(line_index)
+    if len(checkpoints) == 0:
+      return None
+    line_index = max(line_index, checkpoints[-1].line_index)
+    offset = self._skip_lines(checkpoints[-1], line_index)
+    if offset is None:
+      return NOT_INDEXED
+
+    if not hasattr(self._source, "find"):
+      for line_index, (_, text_line) in enumerate(self._source.lines(offset),
+                                                  line_index):
+        if text_line is None:
+          return NOT_INDEXED
+        if string in text_line:
+          return line_index
+      return None
+
+    offset = self._source.find(string, offset)
+    if offset is None:
+      return None
+    checkpoint = self._checkpoint_at_offset(offset)
+    if checkpoint is None:
+      return NOT_INDEXED
+    for line_index, (line_offset, _) in enumerate(
+        self._source.lines(checkpoint.offset),
+        checkpoint.line_index):
+      if line_offset == offset:
+        return line_index
+    return None
+
+  def _skip_lines(self, checkpoint, line_index):
+    """
+    Return the offset of a line by reading lines from a checkpoint before
+    it, or None if it is not available.
+    """
+    for index, (offset, text_line) in enumerate(
+        self._source.lines(checkpoint.offset),
+        checkpoint.line_index):
+      if text_line is None:
+        return None
+      if index == line_index:
+        return offset
+    return None
+
+  def _checkpoint_at_offset(self, offset):
+    """
+    Return the checkpoint of the chunk having a line at an offset, or None
+    if it is not indexed yet.
+    """
+    with self._condition:
+      if not self._is_complete \
+         and (len(self._offsets) == 0 or self._offsets[-1] <= offset):
+        return None
+      number = max(bisect.bisect_right(self._offsets, offset), 1)
+      return text_to_lines.Checkpoint(
+          line_index=self._line_indices[number - 1],
+          offset=self._offsets[number - 1])
+
+  def _path(self):
+    fingerprint = self._source.fingerprint()
+    if fingerprint is None:
+      return None
+    key = hashlib.sha1(repr((_FORMAT_VERSION, fingerprint))
+                       .encode(_ENCODING)).hexdigest()
+    return os.path.join(config.CACHE_DIRECTORY, key + _FILE_EXTENSION)
+
+  def _load(self):
+    if self._is_complete:
+      return True
+    path = self._path()
+    if path is None:
+      return False
+    try:
+      with open(path, "rb") as f:
+        data = f.read()
+      os.utime(path) # used as the time of last access for LRU eviction
+    except OSError:
+      return False
+
+    if len(data) < _HEADER.size:
+      return False
+    number, = _HEADER.unpack_from(data)
+    line_indices = array.array("Q")
+    offsets = array.array("Q")
+    body_size = number * line_indices.itemsize
+    if len(data) != _HEADER.size + 2 * body_size:
+      return False
+    line_indices.frombytes(data[_HEADER.size:_HEADER.size + body_size])
+    offsets.frombytes(data[_HEADER.size + body_size:])
+
+    with self._condition:
+      self._line_indices = line_indices
+      self._offsets = offsets
+      self._is_complete = True
+      self._condition.notify_all()
+    return True
+
+  def _save(self):
+    path = self._path()
+    if path is None:
+      return
+
+    temporary_path = "{}.{}".format(path, os.getpid())
+    try:
+      os.makedirs(config.CACHE_DIRECTORY, exist_ok=True)
+      with open(temporary_path, "wb") as f:
+        f.write(_HEADER.pack(len(self._line_indices)))
+        f.write(self._line_indices.tobytes())
+        f.write(self._offsets.tobytes())
+      os.replace(temporary_path, path)
+      _evict_indices(exception_path=path)
+    except OSError:
+      pass
+
+
+
+# functions
+
+def _evict_indices(exception_path):
+  paths = [os.path.join(config.CACHE_DIRECTORY, filename)
+           for filename in os.listdir(config.CACHE_DIRECTORY)
+           if filename.endswith(_FILE_EXTENSION)]
+  stats = {path: os.stat(path) for path in paths}
+  size = sum(stat.st_size for stat in stats.values())
+
+  for path in sorted(paths, key=lambda path: stats[path].st_mtime):
+    if size <= _MAX_DIRECTORY_SIZE: break
+    if path == exception_path: continue
+    os.remove(path)
+    size -= stats[path].st_size
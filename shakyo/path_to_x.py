@@ -3,26 +3,30 @@ import os.path
 import sys
 import typing
 import urllib.parse
-import urllib.request
-import validators
 
 from . import log
+from . import source
 from . import util
 
 
 
 # constants
 
-_ENCODING = "UTF-8"
 _SUPPORTED_SCHEMES = {"http", "https", "ftp"}
 _TTY_DEVICE_FILE = "/dev/tty" # POSIX compliant
+_TIMEOUT = 10 # seconds
 _PATH_TYPE = typing.Union[str, None]
+_GLOB_CHARS = "*?["
+_BINARY_CHECK_SIZE = 8 * 1024 # bytes read to tell binary files from text
 
 
 
 # functions
 
 def _is_uri(uri):
+  if "://" not in uri: # Avoid importing validators for local paths.
+    return False
+  import validators
   return validators.url(uri)
 
 
@@ -32,31 +36,54 @@ def _read_from_stdin():
   except KeyboardInterrupt:
     log.error("Nothing could be read from stdin.")
 
+  _reopen_tty_as_stdin()
+  return text
+
+
+def _open_stdin():
+  if sys.stdin.isatty():
+    return source.TextSource(_read_from_stdin())
+
+  # The pipe is read through another file descriptor while stdin becomes
+  # the terminal for keys typed by a user.
+  fd = os.dup(sys.stdin.fileno())
+  _reopen_tty_as_stdin()
+  return source.PipeSource(fd)
+
+
+def _reopen_tty_as_stdin():
   os.close(sys.stdin.fileno())
   sys.stdin = open(_TTY_DEVICE_FILE)
 
-  return text
-
 
-def _read_local_file(path):
+def _map_local_file(path):
   try:
-    with open(path, "rb") as f:
-      return f.read().decode(_ENCODING, "replace")
+    return source.FileSource(path)
   except (FileNotFoundError, PermissionError) as exception:
     log.error(exception)
 
 
-def _read_remote_file(uri):
+def _check_uri_scheme(uri):
   if urllib.parse.urlparse(uri).scheme not in _SUPPORTED_SCHEMES:
     log.error("Invalid scheme of URI is detected. "
               "(supported schemes: {})"
               .format(util.sequence_to_string(_SUPPORTED_SCHEMES)))
 
+
+def _open_remote_file(uri):
+  _check_uri_scheme(uri)
+
   log.message("Loading a page...")
+  import http.client
+  import urllib.request
+  from . import http_cache
   try:
-    with urllib.request.urlopen(uri) as response:
-      return response.read().decode(_ENCODING, "replace")
-  except urllib.error.URLError as exception:
+    if urllib.parse.urlparse(uri).scheme in http_cache.SUPPORTED_SCHEMES:
+      return http_cache.open_uri(uri)
+    return source.StreamSource(urllib.request.urlopen(uri,
+                                                      timeout=_TIMEOUT))
+  except (OSError, http.client.HTTPException, http_cache.HttpError) \
+         as exception:
     log.error(exception)
 
 
@@ -64,6 +91,75 @@ def _uri_to_filename(uri):
   return os.path.basename(urllib.parse.urlparse(uri).path)
 
 
+def _directory_to_paths(directory):
+  """
+  List text files in a directory recursively in order of their paths
+  skipping hidden ones.
+  """
+  paths = []
+  for directory, subdirectories, filenames in os.walk(directory):
+    subdirectories[:] = sorted(name for name in subdirectories
+                               if not name.startswith("."))
+    paths.extend(path for path in (os.path.join(directory, filename)
+                                   for filename in sorted(filenames)
+                                   if not filename.startswith("."))
+                 if _is_text_file(path))
+  return paths
+
+
+def _is_text_file(path):
+  try:
+    with open(path, "rb") as f:
+      return b"\0" not in f.read(_BINARY_CHECK_SIZE)
+  except OSError:
+    return False
+
+
+def _glob_to_paths(pattern):
+  import glob
+  paths = []
+  for path in sorted(glob.glob(pattern, recursive=True)):
+    if os.path.isdir(path):
+      paths.extend(_directory_to_paths(path))
+    elif _is_text_file(path):
+      paths.append(path)
+  return paths
+
+
+def expand_paths(paths):
+  """
+  Expand directories and glob patterns into paths of text files in them.
+  No path means stdin which is represented by None.
+  """
+  if len(paths) == 0:
+    return [None]
+
+  expanded_paths = []
+  for path in paths:
+    if _is_uri(path):
+      expanded_paths.append(path)
+    elif os.path.isdir(path):
+      expanded_paths.extend(_directory_to_paths(path))
+    elif not os.path.exists(path) \
+         and any(char in path for char in _GLOB_CHARS):
+      expanded_paths.extend(_glob_to_paths(path))
+    else:
+      expanded_paths.append(path)
+
+  if len(expanded_paths) == 0:
+    log.error("No text file is found in {}."
+              .format(util.sequence_to_string(paths)))
+
+  # The same file is not repeated.
+  known_paths = set()
+  unique_paths = []
+  for path in expanded_paths:
+    if path not in known_paths:
+      known_paths.add(path)
+      unique_paths.append(path)
+  return unique_paths
+
+
 def path_to_filename(path: _PATH_TYPE):
   if path is None:
     return None
@@ -72,9 +168,9 @@ def path_to_filename(path: _PATH_TYPE):
   return os.path.basename(path)
 
 
-def path_to_text(path: _PATH_TYPE):
+def path_to_source(path: _PATH_TYPE):
   if path is None:
-    return _read_from_stdin()
+    return _open_stdin()
   elif _is_uri(path):
-    return _read_remote_file(path)
-  return _read_local_file(path)
+    return _open_remote_file(path)
+  return _map_local_file(path)
@@ -1,14 +1,35 @@
+import fnmatch
+import functools
+import hashlib
+import json
+import os
+import os.path
+import re
+import sys
 import pygments
-import pygments.lexers
-import pygments.styles
-import pygments.lexers.special
+
+from . import config
 
 
 
 # constants
 
-_LEXER_OPTIONS = {"stripall" : True}
-_FALLBACK_LEXER = pygments.lexers.special.TextLexer(**_LEXER_OPTIONS)
+# Submodules of pygments are imported on demand, here and in other modules,
+# because they take long to be imported and their plugins take long to be
+# looked up.
+
+_LEXER_OPTIONS = {"stripnl" : False} # text is stripped by text_to_lines
+_SAMPLE_SIZE = 8 * 1024 # characters of text to guess its language from
+_MODELINE_LINES = 5
+_SHEBANG_PATTERN = re.compile(r"#!\s*(?:\S*/)?(?:env\s+(?:-\S+\s+)*)?(\S+)")
+_MODELINE_PATTERNS = [
+    re.compile(r"-\*-.*\bmode:\s*([\w+#.-]+)"),
+    re.compile(r"-\*-\s*([\w+#.-]+)\s*-\*-"),
+    re.compile(r"\b(?:vi|vim|ex):.*\b(?:ft|filetype|syntax)=([\w+#.-]+)"),
+]
+_PYGMENTS_INDEX_FILENAME = "pygments_index-{}.json"
+_STALE_INDEX_PATTERNS = ["pygments_index-*.json", "lexer_index-*.json"]
+_DISTRIBUTION_SUFFIXES = (".dist-info", ".egg-info")
 
 
 
@@ -16,39 +37,175 @@ _FALLBACK_LEXER = pygments.lexers.special.TextLexer(**_LEXER_OPTIONS)
 
 def guess_lexer(lexer_name=None, filename=None, text=None):
   if lexer_name is not None:
-    return pygments.lexers.get_lexer_by_name(lexer_name)
+    import pygments.lexers
+    return pygments.lexers.get_lexer_by_name(lexer_name, **_LEXER_OPTIONS)
   return _guess_lexer_from_filename_and_text(filename, text)
 
 
 def _guess_lexer_from_filename_and_text(filename, text):
+  sample = None if text is None else text[:_SAMPLE_SIZE]
+
   lexer = None
   if filename is not None:
-    lexer = _guess_lexer_from_filename(filename)
-  if text is not None and lexer is None:
-    lexer = _guess_lexer_from_text(text)
+    lexer = _guess_lexer_from_filename(filename, sample)
+  if sample is not None and lexer is None:
+    lexer = _guess_lexer_from_first_lines(sample)
+  if sample is not None and lexer is None:
+    lexer = _guess_lexer_from_text(sample)
   if lexer is None:
-    lexer = _FALLBACK_LEXER
+    import pygments.lexers.special
+    lexer = pygments.lexers.special.TextLexer(**_LEXER_OPTIONS)
   return lexer
 
 
-def _guess_lexer_from_filename(filename):
-  try:
-    return pygments.lexers.get_lexer_for_filename(filename, **_LEXER_OPTIONS)
-  except pygments.util.ClassNotFound:
-    return None
+def _guess_lexer_from_filename(filename, sample):
+  index = _pygments_index()
+  names = index["extensions"].get(os.path.splitext(filename)[1], []) \
+          + [name for pattern, name in index["patterns"]
+             if fnmatch.fnmatchcase(filename, pattern)]
+
+  if len(set(names)) == 1:
+    return _get_lexer_by_lexer_name(names[0])
+  elif len(names) > 1: # Let Pygments choose one by priority and sample.
+    import pygments.lexers
+    try:
+      return pygments.lexers.get_lexer_for_filename(filename,
+                                                    code=sample,
+                                                    **_LEXER_OPTIONS)
+    except pygments.util.ClassNotFound:
+      return None
+  return None
+
+
+def _guess_lexer_from_first_lines(sample):
+  lines = sample.split('\n', _MODELINE_LINES)[:_MODELINE_LINES]
+
+  match = _SHEBANG_PATTERN.match(lines[0])
+  if match is not None:
+    lexer = _get_lexer_by_alias(os.path.basename(match.group(1)))
+    if lexer is not None:
+      return lexer
+
+  for line in lines:
+    for pattern in _MODELINE_PATTERNS:
+      match = pattern.search(line)
+      if match is not None:
+        lexer = _get_lexer_by_alias(match.group(1))
+        if lexer is not None:
+          return lexer
+  return None
 
 
 def _guess_lexer_from_text(text):
+  import pygments.lexers
   try:
     return pygments.lexers.guess_lexer(text, **_LEXER_OPTIONS)
   except pygments.util.ClassNotFound:
     return None
 
 
+def _get_lexer_by_alias(alias):
+  # e.g. "python3.5" -> "python3" -> "python"
+  for alias in [alias.lower(), alias.lower().rstrip("0123456789."),
+                alias.lower().rstrip("0123456789.-_")]:
+    if alias in _pygments_index()["aliases"]:
+      return _get_lexer_by_lexer_name(_pygments_index()["aliases"][alias])
+  return None
+
+
+def _get_lexer_by_lexer_name(name):
+  import pygments.lexers
+  lexer_class = pygments.lexers.find_lexer_class(name)
+  return None if lexer_class is None else lexer_class(**_LEXER_OPTIONS)
+
+
+@functools.lru_cache(maxsize=None)
+def _pygments_index():
+  """
+  Load an index of lexer names by their aliases, extensions and filename
+  patterns and of style names, building it and saving it in the cache
+  directory at first.
+  """
+  path = _pygments_index_path()
+  try:
+    with open(path) as f:
+      return json.load(f)
+  except (OSError, ValueError):
+    pass
+
+  index = _build_pygments_index()
+  try:
+    os.makedirs(config.CACHE_DIRECTORY, exist_ok=True)
+    temporary_path = "{}.{}".format(path, os.getpid())
+    with open(temporary_path, "w") as f:
+      json.dump(index, f)
+    os.replace(temporary_path, path)
+    _remove_stale_indices(path)
+  except OSError:
+    pass
+  return index
+
+
+def _pygments_index_path():
+  """
+  Make a path of an index specific to the version of Pygments and to the
+  installed plugins.
+  Names of metadata directories of distributions in sys.path, which have
+  their versions, are used instead of entry points of plugins as looking
+  them up takes long.
+  """
+  distributions = []
+  for directory in sys.path:
+    try:
+      with os.scandir(directory or os.curdir) as entries:
+        distributions.extend(sorted(
+            entry.name for entry in entries
+            if entry.name.endswith(_DISTRIBUTION_SUFFIXES)))
+    except OSError:
+      pass
+  key = hashlib.sha1(repr((pygments.__version__, distributions))
+                     .encode("UTF-8")).hexdigest()
+  return os.path.join(config.CACHE_DIRECTORY,
+                      _PYGMENTS_INDEX_FILENAME.format(key))
+
+
+def _remove_stale_indices(path):
+  """
+  Remove indices other than one at a path, which are ones for other
+  versions or plugins or in old formats.
+  """
+  for filename in os.listdir(config.CACHE_DIRECTORY):
+    if filename != os.path.basename(path) \
+       and any(fnmatch.fnmatchcase(filename, pattern)
+               for pattern in _STALE_INDEX_PATTERNS):
+      try:
+        os.remove(os.path.join(config.CACHE_DIRECTORY, filename))
+      except OSError:
+        pass
+
+
+def _build_pygments_index():
+  import pygments.lexers
+  import pygments.styles
+
+  index = {"aliases" : {}, "extensions" : {}, "patterns" : [],
+           "styles" : sorted(pygments.styles.get_all_styles())}
+  for name, aliases, patterns, _ in pygments.lexers.get_all_lexers():
+    for alias in aliases:
+      index["aliases"].setdefault(alias, name)
+    for pattern in patterns:
+      extension = pattern[1:]
+      if pattern.startswith("*.") \
+         and not any(char in extension[1:] for char in ".*?[]"):
+        index["extensions"].setdefault(extension, []).append(name)
+      else:
+        index["patterns"].append([pattern, name])
+  return index
+
+
 def all_lexer_names():
-  return {alias for _, aliases, _, _ in pygments.lexers.get_all_lexers()
-          for alias in aliases}
+  return set(_pygments_index()["aliases"])
 
 
 def all_style_names():
-  return pygments.styles.get_all_styles()
+  return _pygments_index()["styles"]
@@ -0,0 +1,69 @@
+import json
+import os
+import os.path
+import time
+
+from . import config
+
+
+
+# constants
+
+_PATH = os.path.join(config.STATE_DIRECTORY, "sessions.json")
+_MAX_NUMBER_OF_FILES = 1024
+
+
+
+# functions
+
+def load_file_states(paths):
+  """
+  Load states of files saved by the last sessions typing them by their
+  paths, which are None for files without states and stdin.
+  Every state has the time when it was saved as "time".
+  """
+  states = _load_states()
+  return [None if path is None else states.get(_path_to_key(path))
+          for path in paths]
+
+
+def save_file_states(paths, states):
+  """
+  Save states of files by their paths, forgetting ones of files whose
+  states are None.
+  States of the least recently saved files are forgotten when there are
+  too many.
+  """
+  all_states = _load_states()
+  for path, state in zip(paths, states):
+    if path is None:
+      continue
+    elif state is None:
+      all_states.pop(_path_to_key(path), None)
+    else:
+      all_states[_path_to_key(path)] = dict(state, time=time.time())
+
+  keys = sorted(all_states,
+                key=lambda key: all_states[key]["time"],
+                reverse=True)[:_MAX_NUMBER_OF_FILES]
+  try:
+    os.makedirs(config.STATE_DIRECTORY, exist_ok=True)
+    temporary_path = "{}.{}".format(_PATH, os.getpid())
+    with open(temporary_path, "w") as f:
+      json.dump({key : all_states[key] for key in keys}, f)
+    os.replace(temporary_path, _PATH)
+  except OSError:
+    pass
+
+
+def _load_states():
+  try:
+    with open(_PATH) as f:
+      states = json.load(f)
+  except (OSError, ValueError):
+    return {}
+  return states if isinstance(states, dict) else {}
+
+
+def _path_to_key(path):
+  return path if "://" in path else os.path.realpath(path)
@@ -1,5 +1,22 @@
+import array
+import bisect
+import collections
+import queue
+import threading
+import time
+
 from . import consolekit as ck
 from . import config
+from . import latency_tracer
+from . import source
+
+
+
+# constants
+
+_FOLDED_LINES_CAPACITY = 4096
+_PREFETCHED_SCREENS = 4
+_MIN_FOLDED_WIDTH = 2 # for double-width characters
 
 
 
@@ -8,53 +25,229 @@ from . import config
 class Shakyo:
   CURSOR_WIDTH = 1
 
-  def __init__(self, console, example_lines):
+  def __init__(self,
+               console,
+               example_lines,
+               tracer=None,
+               max_fps=60,
+               examples=None,
+               resume=False):
+    """
+    examples is an object like ExampleFiles which locates and finds lines
+    given by example_lines for a user to go to a line or search for a
+    string. They are not available without it.
+    With resume, typing starts at the line where the last session stopped,
+    which is loaded by examples.
+    """
+    assert max_fps > 0
     self._console = console
+    self._examples = examples
+    self._prompt = None
+    self._tracer = tracer or latency_tracer.NullLatencyTracer()
+    self._frame_time = 1 / max_fps
+    self._chars = collections.deque() # typed but not handled yet
     self._geometry = _Geometry(console)
-    self._input_line = ck.Line()
     self._example_lines = _FoldedLines(example_lines,
-                                       max_width=(console.screen_width - 1))
+                                       max_width=self._example_width,
+                                       **self._folded_lines_sizes)
+    if resume and examples is not None:
+      # Lines above the current one are folded from the same checkpoint.
+      location = examples.load_session(self._geometry.y_input)
+      if location is not None:
+        self._example_lines.jump(*location)
     if self._example_lines[0] is None:
       raise Exception("No line can be read from the example source.")
+    self._clear_input_line()
+
+  @property
+  def position(self):
+    """
+    Position of the current line which can be saved by examples, or None
+    after all lines are typed.
+    """
+    if self._example_lines[0] is None:
+      return None
+    return self._example_lines.position()
 
   def do(self):
+    # The first screen is not traced as no key is handled for it.
+    self._print_all_example_lines()
+    self._update_input_line()
+    self._console.refresh()
+
+    while self._handle_chars(time.perf_counter() + self._frame_time) \
+          and self._example_lines[0] is not None:
+      with self._tracer.stage("render"):
+        self._update_input_line()
+      with self._tracer.stage("refresh"):
+        self._console.refresh()
+      self._tracer.end_iteration()
+
+  def _handle_chars(self, frame_end_time):
+    """
+    Handle characters typed until the end of a frame, and ones typed at once
+    like pasted ones for at most the time of a frame, before rendering
+    them at once.
+    Return False if a user quits.
+    """
+    timeout = None # The first character is waited for forever.
+    busy_end_time = None
+    while True:
+      if len(self._chars) == 0:
+        self._chars.extend(self._console.get_chars(timeout))
+        if len(self._chars) == 0:
+          return True
+      if busy_end_time is None:
+        busy_end_time = time.perf_counter() + self._frame_time
+
+      while len(self._chars) != 0:
+        char = self._chars.popleft()
+        if char in config.QUIT_CHARS and self._prompt is None:
+          return False
+        with self._tracer.stage("input"):
+          self._handle_char(char)
+        # Characters after all lines are typed are not handled.
+        if self._example_lines[0] is None:
+          return True
+        if time.perf_counter() >= busy_end_time:
+          self._handle_pending_resize()
+          return True
+
+      timeout = max(frame_end_time - time.perf_counter(), 0)
+
+  def _handle_pending_resize(self):
+    # The console has already been resized and cannot be rendered by the
+    # current geometry, so characters typed before are handled after it.
+    if ck.RESIZE_CHAR in self._chars:
+      self._chars.remove(ck.RESIZE_CHAR)
+      with self._tracer.stage("input"):
+        self._handle_char(ck.RESIZE_CHAR)
+
+  def _handle_char(self, char):
+    if char == ck.RESIZE_CHAR:
+      self._resize()
+    elif self._prompt is not None:
+      self._handle_prompt_char(char)
+    elif char == config.CLEAR_CHAR:
+      self._clear_input_line()
+    elif char in config.DELETE_CHARS:
+      self._input_line.delete_char()
+    elif char == config.PAGE_DOWN_CHAR:
+      self._page_down()
+      self._clear_input_line()
+    elif char == config.PAGE_UP_CHAR:
+      self._page_up()
+      self._clear_input_line()
+    elif char == config.SCROLL_UP_CHAR:
+      self._scroll_up()
+      self._clear_input_line()
+    elif (char == '\n' and self._input_line.matches_example) \
+         or (char == config.SCROLL_DOWN_CHAR):
+      self._scroll_down()
+      self._clear_input_line()
+    elif char in {config.GOTO_LINE_CHAR, config.SEARCH_CHAR}:
+      if self._examples is not None:
+        self._prompt = _Prompt(char, self._line_position())
+    elif ck.is_printable_char(char):
+      self._type_char(char)
+
+  def _handle_prompt_char(self, char):
+    prompt = self._prompt
+    if char in config.QUIT_CHARS:
+      if prompt.command_char == config.SEARCH_CHAR:
+        self._jump(*prompt.origin)
+      self._close_prompt()
+    elif char == '\n':
+      if prompt.command_char == config.GOTO_LINE_CHAR and prompt.string:
+        self._jump(prompt.origin[0], int(prompt.string) - 1)
+      self._close_prompt()
+    elif char in config.DELETE_CHARS:
+      prompt.string = prompt.string[:-1]
+      self._search(prompt.origin)
+    elif char == config.SEARCH_CHAR:
+      file_index, line_index = self._line_position()
+      self._search((file_index, line_index + 1))
+    elif ck.is_printable_char(char) \
+         and (prompt.command_char == config.SEARCH_CHAR or char.isdigit()):
+      prompt.string += char
+      self._search(prompt.origin)
+
+  def _close_prompt(self):
+    self._prompt = None
     self._print_all_example_lines()
 
-    while self._example_lines[0] is not None:
-      self._update_input_line()
-      char = self._console.get_char()
+  def _line_position(self):
+    checkpoint, number_of_raw_lines, _ = self._example_lines.position()
+    return self._examples.position(checkpoint, number_of_raw_lines)
+
+  def _jump(self, file_index, line_index):
+    # Lines above the current one are folded from the same checkpoint.
+    location = self._examples.locate(file_index,
+                                     line_index,
+                                     self._geometry.y_input)
+    if location is None: return
+    with self._tracer.stage("jump"):
+      self._example_lines.jump(*location)
+    self._clear_input_line()
+    self._print_all_example_lines()
 
-      if char in config.QUIT_CHARS:
-        break
-      elif char == config.CLEAR_CHAR:
-        self._input_line = ck.Line()
-      elif char in config.DELETE_CHARS:
-        self._input_line = self._input_line[:-1]
-      elif char == config.PAGE_DOWN_CHAR:
-        self._input_line = ck.Line()
-        self._page_down()
-      elif char == config.PAGE_UP_CHAR:
-        self._input_line = ck.Line()
-        self._page_up()
-      elif char == config.SCROLL_UP_CHAR:
-        self._input_line = ck.Line()
-        self._scroll_up()
-      elif (char == '\n' and self._input_line.normalized
-                             == self._example_lines[0].normalized) \
-           or (char == config.SCROLL_DOWN_CHAR):
-        self._input_line = ck.Line()
-        self._scroll_down()
-      elif ck.is_printable_char(char) \
-           and (self._input_line + ck.Character(char)).width \
-               + self.CURSOR_WIDTH <= self._console.screen_width:
-        self._input_line += ck.Character(char,
-                                         self._next_input_char_attr(char))
+  def _search(self, position):
+    """
+    Go to the first line having a string in a prompt from a position, or
+    to the position if the string is empty.
+    """
+    if self._prompt.command_char != config.SEARCH_CHAR: return
+    found_position = position
+    if self._prompt.string:
+      with self._tracer.stage("search"):
+        found_position = self._examples.find(self._prompt.string, *position)
+    self._prompt.is_indexed = found_position is not self._examples.NOT_INDEXED
+    self._prompt.is_found = found_position is not None
+    if self._prompt.is_indexed and self._prompt.is_found:
+      self._jump(*found_position)
+
+  def _type_char(self, char):
+    if self._input_line.width_with_char(char) + self.CURSOR_WIDTH \
+       > self._console.screen_width:
+      return
+    with self._tracer.stage("check"):
+      attr = self._next_input_char_attr(char)
+    self._input_line.append_char(char, attr)
+
+  def _resize(self):
+    # The console has already been resized and its buffers are blank.
+    self._geometry = _Geometry(self._console)
+    self._example_lines.refold(self._example_width,
+                               **self._folded_lines_sizes)
+
+    typed_string = str(self._input_line.line)
+    self._clear_input_line()
+    for char in typed_string:
+      self._type_char(char)
+    self._print_all_example_lines()
+
+  @property
+  def _example_width(self):
+    return max(self._console.screen_width - 1, _MIN_FOLDED_WIDTH)
+
+  @property
+  def _folded_lines_sizes(self):
+    return {"capacity" : max(_FOLDED_LINES_CAPACITY,
+                             4 * self._console.screen_height),
+            "prefetch" : _PREFETCHED_SCREENS * self._console.screen_height}
+
+  def _clear_input_line(self):
+    self._input_line = _InputLine(self._example_lines[0])
 
   def _update_input_line(self):
     self._console.print_line(self._geometry.y_input, self._example_lines[0])
     self._console.print_line(self._geometry.y_input,
-                             self._input_line,
+                             self._input_line.line,
                              clear=False)
+    if self._prompt is not None:
+      # The cursor is left on the prompt.
+      self._console.print_line(self._geometry.y_bottom,
+                               self._prompt.line(self._console))
 
   def _scroll_down(self):
     self._example_lines.base_index += 1
@@ -84,10 +277,9 @@ class Shakyo:
       self._scroll_up()
 
   def _print_all_example_lines(self):
-    for index in range(self._geometry.y_bottom - self._geometry.y_input + 1):
-      if self._example_lines[index] is None: break
-      self._console.print_line(self._geometry.y_input + index,
-                               self._example_lines[index])
+    for y in range(self._geometry.y_bottom + 1):
+      line = self._example_lines[y - self._geometry.y_input]
+      self._console.print_line(y, line if line is not None else ck.Line())
 
   def _next_input_char_attr(self, char):
     attr_correct = self._console.decoration_attrs.normal
@@ -97,26 +289,121 @@ class Shakyo:
 
   @property
   def _next_example_char_attr(self):
-    normalized_example_line = self._example_lines[0].normalized
-    return normalized_example_line[min(len(self._input_line.normalized),
-                                       len(normalized_example_line) - 1)].attr\
-           if len(normalized_example_line) != 0 else \
+    return self._input_line.next_example_char_attr \
+           if self._input_line.next_example_char_attr is not None else \
            self._console.decoration_attrs.normal
 
   def _is_correct_char(self, char):
-    normalized_input_line = self._input_line.normalized
-    normalized_example_line = self._example_lines[0].normalized
-    normalized_new_input_line = (self._input_line + ck.Character(char)) \
-                                .normalized
+    return self._input_line.is_correct_char(char)
 
-    if len(normalized_new_input_line) > len(normalized_example_line):
-      return False
-    new_char_range = slice(len(normalized_input_line),
-                           len(normalized_new_input_line))
-    if normalized_new_input_line[new_char_range] \
-       != normalized_example_line[new_char_range]:
-      return False
-    return True
+
+class _InputLine:
+  """
+  A mutable line typed by a user which is checked against an example line.
+  Its normalized length, width and correctness are updated incrementally
+  on every edit.
+  """
+
+  def __init__(self, example_line=None):
+    self._example_line = (example_line if example_line is not None else
+                          ck.Line()).normalized
+    self._chars = []
+    self._attrs = array.array("I")
+    self._normalized_lengths = [0]
+    self._widths = [0]
+    self._numbers_of_wrong_chars = [0]
+    self._line = ck.Line()
+
+  def __len__(self):
+    return len(self._chars)
+
+  @property
+  def line(self):
+    if self._line is None:
+      self._line = ck.Line.from_string("".join(self._chars), self._attrs)
+    return self._line
+
+  @property
+  def width(self):
+    return self._widths[-1]
+
+  @property
+  def matches_example(self):
+    return self._numbers_of_wrong_chars[-1] == 0 \
+           and self._normalized_lengths[-1] == len(self._example_line)
+
+  @property
+  def next_example_char_attr(self):
+    if len(self._example_line) == 0:
+      return None
+    return self._example_line[min(self._normalized_lengths[-1],
+                                  len(self._example_line) - 1)].attr
+
+  def width_with_char(self, char):
+    return self.width + ck.string_width(self._normalize_next_char(char))
+
+  def is_correct_char(self, char):
+    normalized_string = self._normalize_next_char(char)
+    start = self._normalized_lengths[-1]
+    stop = start + len(normalized_string)
+    return stop <= len(self._example_line) \
+           and str(self._example_line)[start:stop] == normalized_string
+
+  def append_char(self, char, attr):
+    normalized_string = self._normalize_next_char(char)
+    is_correct = self.is_correct_char(char)
+    self._chars.append(char)
+    self._attrs.append(attr)
+    self._normalized_lengths.append(self._normalized_lengths[-1]
+                                    + len(normalized_string))
+    self._widths.append(self.width + ck.string_width(normalized_string))
+    self._numbers_of_wrong_chars.append(self._numbers_of_wrong_chars[-1]
+                                        + (0 if is_correct else 1))
+    self._line = None
+
+  def delete_char(self):
+    if len(self) == 0: return
+    self._chars.pop()
+    self._attrs.pop()
+    self._normalized_lengths.pop()
+    self._widths.pop()
+    self._numbers_of_wrong_chars.pop()
+    self._line = None
+
+  def _normalize_next_char(self, char):
+    return ck.Line.normalize_char(char, self.width)
+
+
+class _Prompt:
+  """
+  A string typed by a user at the bottom of a screen after a command
+  character to go to a line or to search for a string.
+  """
+
+  _LABELS = {config.GOTO_LINE_CHAR : "goto line: ",
+             config.SEARCH_CHAR : "search: "}
+  _NOT_FOUND_LABEL = "search (not found): "
+  _NOT_INDEXED_LABEL = "search (not indexed yet): "
+
+  def __init__(self, command_char, origin):
+    self.command_char = command_char
+    self.origin = origin # position before the command
+    self.string = ""
+    self.is_found = True
+    self.is_indexed = True
+
+  def line(self, console):
+    if not self.is_indexed:
+      label = self._NOT_INDEXED_LABEL
+    elif not self.is_found:
+      label = self._NOT_FOUND_LABEL
+    else:
+      label = self._LABELS[self.command_char]
+    return ck.Line.from_string(
+        label + self.string,
+        array.array("I", [console.decoration_attrs.reverse]) * len(label)
+        + array.array("I", [console.decoration_attrs.normal])
+          * len(self.string))
 
 
 class _Geometry:
@@ -125,24 +412,46 @@ class _Geometry:
     self.y_bottom = console.screen_height - 1
 
 
+_FoldedLine = collections.namedtuple(
+    "_FoldedLine",
+    ("line", "checkpoint_index", "raw_line_number", "start",
+     "checkpoint")) # of raw lines only in the first line after one
+
+
 class _FoldedLines:
-  def __init__(self, raw_lines, max_width=79):
-    assert max_width >= 2 # for double-width characters
-    self._line_generator = self._fold_lines(raw_lines, max_width)
-    self._lines = []
+  """
+  Lines folded from raw lines which are read lazily.
+  Only a window of at most capacity lines is kept in memory.
+  Lines behind the window are made again from the nearest checkpoint of
+  raw lines when they are accessed.
+  When lines are folded again by another width or jumped to, only lines
+  from the checkpoint before the current line are folded at first. Indices
+  of checkpoints before it are found again only when lines before them are
+  accessed, so indices of lines can become negative.
+  Raw lines are read by a thread prefetching lines and by the thread
+  accessing lines at the same time, so raw_lines and sources of its lines
+  must be safe to be read by more than one thread. Checkpoints are indexed
+  only by the thread accessing lines.
+  """
+
+  def __init__(self, raw_lines, max_width=79, capacity=4096, prefetch=0):
+    assert max_width >= _MIN_FOLDED_WIDTH
+    assert capacity >= 1 and prefetch >= 0
+    self._raw_lines = raw_lines
+    self._max_width = max_width
+    self._capacity = capacity
+    self._prefetch = prefetch
+    self._checkpoint_indices = []
+    self._checkpoints = []
+    self._unindexed_checkpoints = [] # before the first indexed one
+    self._lines = collections.deque()
+    self._first_index = 0
+    self._line_generator = None # made when lines are accessed first
     self._base_index = 0
 
   def __getitem__(self, relative_index):
-    assert isinstance(relative_index, int)
-
-    index = self._base_index + relative_index
-
-    for line in self._line_generator:
-      self._lines.append(line)
-      if index < len(self._lines):
-        break
-
-    return self._lines[index] if 0 <= index < len(self._lines) else None
+    folded_line = self._get_folded_line(relative_index)
+    return None if folded_line is None else folded_line.line
 
   @property
   def base_index(self):
@@ -153,27 +462,264 @@ class _FoldedLines:
     assert isinstance(base_index, int)
     self._base_index = base_index
 
-  @classmethod
-  def _fold_lines(cls, lines, max_width):
-    for line in lines:
-      while line.width > max_width:
-        new_line, line = cls._split_line(line, max_width)
-        yield new_line
-      yield line
-
-  @staticmethod
-  def _split_line(line, max_width):
-    assert line.width > max_width
-
-    # binary search for max index to construct a line of max width
-    min_index = 0
-    max_index = len(line)
-    while min_index != max_index:
-      middle_index = (max_index - min_index + 1) // 2 + min_index
-      if line[:middle_index].width <= max_width:
-        min_index = middle_index
-      else:
-        max_index = middle_index - 1
-
-    assert line[:min_index].width <= max_width
-    return line[:min_index], line[min_index:]
+  def refold(self, max_width, capacity=None, prefetch=None):
+    """
+    Fold lines again by a new width and move base_index to the line which
+    has the first character of the current one.
+    capacity and prefetch are changed if they are given, e.g. for a new
+    height of a screen.
+    """
+    assert max_width >= _MIN_FOLDED_WIDTH
+    assert capacity is None or capacity >= 1
+    assert prefetch is None or prefetch >= 0
+    current_line = self._get_folded_line(0)
+    assert current_line is not None
+
+    self._stop_line_generator()
+    checkpoint_number = bisect.bisect_left(self._checkpoint_indices,
+                                           current_line.checkpoint_index)
+    checkpoint = self._checkpoints[checkpoint_number]
+    self._unindexed_checkpoints.extend(self._checkpoints[:checkpoint_number])
+
+    self._max_width = max_width
+    if capacity is not None:
+      self._capacity = capacity
+    if prefetch is not None:
+      self._prefetch = prefetch
+    self._restart(checkpoint, current_line.checkpoint_index)
+    self._move_forward(current_line.raw_line_number, current_line.start)
+
+  def jump(self, checkpoints, number_of_raw_lines, start=0):
+    """
+    Move base_index to the line which has a character at start of a raw
+    line a number of raw lines after the last of checkpoints, which are
+    ones of raw lines before it in order, and forget lines so far.
+    Lines are folded only from the last checkpoint as they are after
+    refold().
+    """
+    assert len(checkpoints) >= 1 and number_of_raw_lines >= 0
+    self._stop_line_generator()
+    self._unindexed_checkpoints = list(checkpoints[:-1])
+    self._restart(checkpoints[-1], self._base_index)
+    self._move_forward(number_of_raw_lines, start)
+
+  def position(self):
+    """
+    Return the checkpoint of raw lines before the current line, the
+    number of raw lines from it to the one of the current line and the
+    index of the first character of the current line in the raw line,
+    which can be passed to jump() with checkpoints before it.
+    """
+    current_line = self._get_folded_line(0)
+    assert current_line is not None
+    checkpoint = self._checkpoints[bisect.bisect_left(
+        self._checkpoint_indices,
+        current_line.checkpoint_index)]
+    return checkpoint, current_line.raw_line_number, current_line.start
+
+  def _restart(self, checkpoint, index):
+    """
+    Forget indexed checkpoints and lines, and fold lines from a checkpoint
+    at an index, which becomes base_index.
+    """
+    self._checkpoint_indices = [index]
+    self._checkpoints = [checkpoint]
+    self._line_generator = self._fold_lines(checkpoint, index)
+    self._lines = collections.deque()
+    self._first_index = index
+    self._base_index = index
+
+  def _move_forward(self, number_of_raw_lines, start):
+    """
+    Move base_index forward from the first line of a raw line to the line
+    which has a character at start of a raw line a number of raw lines
+    after it, or to the last line.
+    """
+    while True:
+      next_line = self._get_folded_line(1)
+      if next_line is None:
+        break
+      elif next_line.start == 0:
+        if number_of_raw_lines == 0:
+          break
+        number_of_raw_lines -= 1
+      elif number_of_raw_lines == 0 and next_line.start > start:
+        break
+      self._base_index += 1
+
+  def _get_folded_line(self, relative_index):
+    assert isinstance(relative_index, int)
+
+    index = self._base_index + relative_index
+    while index < self._first_line_index():
+      if not self._index_previous_checkpoint():
+        return None
+    if index < self._first_index:
+      self._rewind(index)
+    elif self._line_generator is None:
+      self._line_generator = self._fold_lines(None, 0)
+
+    while index >= self._first_index + len(self._lines):
+      line = self._next_line()
+      if line is None:
+        return None
+      self._lines.append(line)
+      if len(self._lines) > self._capacity:
+        self._lines.popleft()
+        self._first_index += 1
+
+    return self._lines[index - self._first_index]
+
+  def _first_line_index(self):
+    """
+    Return the index of the first line, or one of the first indexed
+    checkpoint if there are unindexed ones.
+    """
+    return self._checkpoint_indices[0] if self._checkpoint_indices else 0
+
+  def _index_previous_checkpoint(self):
+    """
+    Find the index of the last unindexed checkpoint by folding raw lines
+    from it to the first indexed one.
+    """
+    if len(self._unindexed_checkpoints) == 0:
+      return False
+    checkpoint = self._unindexed_checkpoints[-1]
+    next_checkpoint = self._checkpoints[0]
+    next_index = self._checkpoint_indices[0]
+
+    number_of_lines = 0
+    for raw_checkpoint, raw_line in self._raw_lines(checkpoint):
+      if raw_checkpoint == next_checkpoint:
+        break
+      number_of_lines += sum(1 for _ in raw_line.fold(self._max_width))
+
+    self._unindexed_checkpoints.pop()
+    self._checkpoint_indices.insert(0, next_index - number_of_lines)
+    self._checkpoints.insert(0, checkpoint)
+    return True
+
+  def _rewind(self, index):
+    first_index = max(self._first_line_index(), index - self._capacity // 2)
+    checkpoint_index = bisect.bisect_right(self._checkpoint_indices,
+                                           first_index) - 1
+    line_index = self._checkpoint_indices[checkpoint_index]
+    checkpoint = self._checkpoints[checkpoint_index]
+
+    self._stop_line_generator()
+    self._line_generator = self._fold_lines(checkpoint, line_index)
+    for _ in range(first_index - line_index):
+      self._next_line()
+    self._lines = collections.deque()
+    self._first_index = first_index
+
+  def _next_line(self):
+    line = next(self._line_generator, None)
+    if line is not None and line.checkpoint is not None:
+      self._add_checkpoint(line.checkpoint_index, line.checkpoint)
+    return line
+
+  def _stop_line_generator(self):
+    if isinstance(self._line_generator, _Prefetcher):
+      self._line_generator.stop()
+
+  def _fold_lines(self, checkpoint, index):
+    # Raw lines are got here, in the thread using the console.
+    lines = self._generate_folded_lines(self._raw_lines(checkpoint),
+                                        index,
+                                        self._max_width)
+    return _Prefetcher(lines, self._prefetch) if self._prefetch > 0 else lines
+
+  def _generate_folded_lines(self, raw_lines, index, max_width):
+    # Nothing is changed here since lines can be prefetched by a thread
+    # left running after the prefetcher is stopped.
+    checkpoint_index = index
+    raw_line_number = 0 # from the checkpoint
+    for raw_checkpoint, raw_line in raw_lines:
+      if raw_checkpoint is not None:
+        checkpoint_index = index
+        raw_line_number = 0
+      start = 0
+      for line in raw_line.fold(max_width):
+        yield _FoldedLine(line, checkpoint_index, raw_line_number, start,
+                          raw_checkpoint if start == 0 else None)
+        start += len(line)
+        index += 1
+      raw_line_number += 1
+
+  def _add_checkpoint(self, index, checkpoint):
+    if not self._checkpoints or index > self._checkpoint_indices[-1]:
+      self._checkpoint_indices.append(index)
+      self._checkpoints.append(checkpoint)
+
+
+class _Prefetcher:
+  """
+  An iterator which gets items from another iterator in a background thread
+  and keeps at most size items ready through a bounded queue.
+  """
+
+  _END = object()
+  _TIMEOUT = 0.1 # second
+
+  def __init__(self, iterator, size):
+    self._queue = queue.Queue(maxsize=size)
+    self._is_stopped = threading.Event()
+    self._is_exhausted = False
+    threading.Thread(target=self._prefetch,
+                     args=(iterator,),
+                     daemon=True).start()
+
+  def __iter__(self):
+    return self
+
+  def __next__(self):
+    if self._is_exhausted:
+      raise StopIteration
+
+    item = self._queue.get()
+    if item is self._END:
+      self._is_exhausted = True
+      raise StopIteration
+    elif isinstance(item, _PrefetchError):
+      self._is_exhausted = True
+      raise item.exception
+    return item
+
+  def stop(self):
+    """
+    Stop prefetching items without waiting for the thread, which can be in
+    the middle of getting an item, e.g. lexing lines or waiting for a
+    source. It ends by itself before putting another item.
+    """
+    self._is_stopped.set()
+    try:
+      while True:
+        self._queue.get_nowait()
+    except queue.Empty:
+      pass
+
+  def _prefetch(self, iterator):
+    # Sources do not wait for lines not written yet after stop().
+    source.cancel_waits_on(self._is_stopped)
+    try:
+      for item in iterator:
+        if not self._put(item): return
+    except Exception as exception:
+      self._put(_PrefetchError(exception))
+      return
+    self._put(self._END)
+
+  def _put(self, item):
+    while not self._is_stopped.is_set():
+      try:
+        self._queue.put(item, timeout=self._TIMEOUT)
+        return True
+      except queue.Full:
+        pass
+    return False
+
+
+class _PrefetchError:
+  def __init__(self, exception):
+    self.exception = exception
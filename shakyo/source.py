@@ -0,0 +1,310 @@
+import hashlib
+import mmap
+import os
+import threading
+
+
+
+# constants
+
+_CHUNK_SIZE = 64 * 1024
+_FULLY_HASHED_SIZE = 16 * 1024 * 1024
+_NUMBER_OF_HASHED_SAMPLES = 64
+_ENCODING = "UTF-8"
+_HEAD_TIMEOUT = 0.2 # seconds to wait for a head of a slowly written pipe
+_CANCEL_INTERVAL = 0.1 # seconds between checks of cancelled waits
+
+_thread_state = threading.local() # with an event cancelling waits
+
+
+
+# classes
+
+class TextSource:
+  """
+  A source of example lines held in memory as a string.
+  Offsets of lines are indices in the string.
+  Lines can be read by more than one thread as the string is immutable.
+  """
+
+  def __init__(self, text):
+    assert isinstance(text, str)
+    self._text = text
+    self._fingerprint = None
+
+  def lines(self, offset=0):
+    while offset <= len(self._text):
+      end = self._text.find('\n', offset)
+      end = len(self._text) if end == -1 else end
+      yield offset, self._text[offset:end]
+      offset = end + 1
+
+  def head(self, size):
+    return self._text[:size]
+
+  def find(self, string, offset=0):
+    """
+    Return the offset of the first line having a string from an offset, or
+    None if it is not found.
+    """
+    index = self._text.find(string, offset)
+    return None if index == -1 else self._text.rfind('\n', 0, index) + 1
+
+  def fingerprint(self):
+    if self._fingerprint is None:
+      self._fingerprint = hashlib.sha1(
+          self._text.encode(_ENCODING, "replace")).hexdigest()
+    return self._fingerprint
+
+
+class FileSource:
+  """
+  A source of example lines read from a memory-mapped local file.
+  Lines are decoded only when they are read.
+  Offsets of lines are byte offsets in the file.
+  Lines can be read by more than one thread as the mapping is read-only.
+  """
+
+  def __init__(self, path):
+    with open(path, "rb") as f:
+      self._stat = os.fstat(f.fileno())
+      try:
+        self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+      except ValueError: # empty files cannot be mapped
+        self._buffer = b""
+    self._fingerprint = None
+
+  def lines(self, offset=0):
+    while offset <= len(self._buffer):
+      end = self._buffer.find(b'\n', offset)
+      end = len(self._buffer) if end == -1 else end
+      yield offset, self._buffer[offset:end].decode(_ENCODING, "replace")
+      offset = end + 1
+
+  def head(self, size):
+    return self._buffer[:size].decode(_ENCODING, "ignore")
+
+  def find(self, string, offset=0):
+    """
+    Do the same as TextSource.find in the whole file at once.
+    """
+    index = self._buffer.find(string.encode(_ENCODING), offset)
+    return None if index == -1 else self._buffer.rfind(b'\n', 0, index) + 1
+
+  def fingerprint(self):
+    """
+    Hash the whole file if it is small.
+    Otherwise, hash its size, modification time and evenly spaced samples
+    so as not to read all of it.
+    """
+    if self._fingerprint is None:
+      self._fingerprint = self._hash()
+    return self._fingerprint
+
+  def _hash(self):
+    if len(self._buffer) <= _FULLY_HASHED_SIZE:
+      return hashlib.sha1(self._buffer).hexdigest()
+
+    sha1 = hashlib.sha1(repr((len(self._buffer),
+                              self._stat.st_mtime_ns)).encode(_ENCODING))
+    sample_size = _FULLY_HASHED_SIZE // _NUMBER_OF_HASHED_SAMPLES
+    for index in range(_NUMBER_OF_HASHED_SAMPLES):
+      start = (len(self._buffer) - sample_size) * index \
+              // (_NUMBER_OF_HASHED_SAMPLES - 1)
+      sha1.update(self._buffer[start:start + sample_size])
+    return sha1.hexdigest()
+
+
+class StreamSource:
+  """
+  A source of example lines read lazily from a binary stream in chunks.
+  Bytes read once are kept so that lines can be read again from any offset.
+  Offsets of lines are byte offsets in the stream.
+  Lines can be read by more than one thread.
+  """
+
+  def __init__(self, stream, chunk_size=_CHUNK_SIZE):
+    self._stream = stream
+    self._chunk_size = chunk_size
+    self._buffer = bytearray()
+    self._lock = threading.Lock()
+
+  def lines(self, offset=0):
+    while offset <= len(self._buffer) or self._read_chunk():
+      end = self._find_newline(offset)
+      yield offset, self._buffer[offset:end].decode(_ENCODING, "replace")
+      offset = end + 1
+
+  def head(self, size):
+    while len(self._buffer) < size and self._read_chunk():
+      pass
+    return self._buffer[:size].decode(_ENCODING, "ignore")
+
+  def fingerprint(self):
+    return None # The whole stream is not known in advance.
+
+  def _find_newline(self, offset):
+    start = offset
+    while True:
+      end = self._buffer.find(b'\n', start)
+      if end != -1:
+        return end
+      start = len(self._buffer)
+      if not self._read_chunk():
+        return len(self._buffer)
+
+  def _read_chunk(self):
+    size = len(self._buffer)
+    with self._lock:
+      if len(self._buffer) != size: # read by another thread
+        return True
+      if self._stream is None:
+        return False
+
+      try:
+        chunk = self._read(self._chunk_size)
+      except OSError: # The rest of a broken stream is treated as missing.
+        chunk = b""
+
+      if not chunk:
+        self._stream.close()
+        self._stream = None
+        return False
+
+      self._buffer.extend(chunk)
+      return True
+
+  def _read(self, size):
+    if hasattr(self._stream, "read1"):
+      return self._stream.read1(size)
+    return self._stream.read(size)
+
+
+class PipeSource:
+  """
+  A source of example lines read from a pipe by a background thread while
+  they are still written to it.
+  Bytes read are spooled into an unlinked temporary file so that lines can
+  be read again from any offset without keeping the whole stream in memory.
+  Offsets of lines are byte offsets in the stream.
+  Lines can be read by more than one thread.
+  """
+
+  def __init__(self, fd, chunk_size=_CHUNK_SIZE):
+    self._fd = fd
+    self._chunk_size = chunk_size
+    self._spool = None
+    self._size = 0
+    self._is_closed = False
+    self._condition = threading.Condition()
+
+  def lines(self, offset=0):
+    """
+    None is yielded as a line before waiting for the writer so that lines
+    read so far can be processed first.
+    Lines end early if waits in the thread are cancelled by cancel_waits_on().
+    """
+    window_offset = offset
+    window = b""
+    while True:
+      if not self._is_available(offset):
+        yield offset, None
+      size = self._wait(offset)
+      if size is None or offset > size: break
+
+      end = window.find(b'\n', offset - window_offset)
+      while end == -1:
+        window_end = window_offset + len(window)
+        if not self._is_available(window_end):
+          yield offset, None
+        size = self._wait(window_end)
+        if size is None: return
+        if size == window_end: # the end of the stream
+          end = len(window)
+          break
+        # Bytes before the current line are not kept.
+        window = window[offset - window_offset:] \
+                 + self._read(window_end,
+                              min(self._chunk_size, size - window_end))
+        window_offset = offset
+        end = window.find(b'\n', window_end - window_offset)
+      yield offset, window[offset - window_offset:end].decode(_ENCODING,
+                                                              "replace")
+      offset = window_offset + end + 1
+
+  def head(self, size):
+    """
+    Decode the beginning of the stream which is available in a short time
+    not to wait for a slow writer.
+    """
+    self._wait(0)
+    with self._condition:
+      self._condition.wait_for(
+          lambda: self._size >= size or self._is_closed,
+          _HEAD_TIMEOUT)
+      size = min(size, self._size)
+    return self._read(0, size).decode(_ENCODING, "ignore")
+
+  def fingerprint(self):
+    return None # The whole stream is not known in advance.
+
+  def _is_available(self, offset):
+    return self._size > offset or self._is_closed
+
+  def _wait(self, offset):
+    """
+    Wait until a byte at an offset is spooled or the pipe is closed, and
+    return the size of spooled bytes, or None if waits in the thread are
+    cancelled before it.
+    """
+    if self._is_available(offset):
+      return self._size
+
+    cancel_event = getattr(_thread_state, "cancel_event", None)
+    with self._condition:
+      if self._spool is None:
+        # The thread is started lazily so that processes can be forked
+        # before it.
+        import tempfile # It takes long to be imported.
+        self._spool = tempfile.TemporaryFile()
+        threading.Thread(target=self._read_pipe, daemon=True).start()
+      while not self._is_available(offset):
+        if cancel_event is None:
+          self._condition.wait()
+        elif cancel_event.is_set():
+          return None
+        else:
+          self._condition.wait(_CANCEL_INTERVAL)
+      return self._size
+
+  def _read(self, offset, size):
+    return os.pread(self._spool.fileno(), size, offset) if size > 0 else b""
+
+  def _read_pipe(self):
+    try:
+      while True:
+        chunk = os.read(self._fd, self._chunk_size)
+        if not chunk: break
+        self._spool.write(chunk)
+        self._spool.flush()
+        with self._condition:
+          self._size += len(chunk)
+          self._condition.notify_all()
+    except OSError: # The rest of a broken pipe is treated as missing.
+      pass
+    finally:
+      os.close(self._fd)
+      with self._condition:
+        self._is_closed = True
+        self._condition.notify_all()
+
+
+
+# functions
+
+def cancel_waits_on(event):
+  """
+  Make sources stop giving lines in the current thread instead of waiting
+  for ones not written yet once an event is set.
+  """
+  _thread_state.cancel_event = event
@@ -1,17 +1,72 @@
-import pygments.formatter
-import pygments.styles
+import array
+import bisect
+import collections
+import copy
+import functools
+import itertools
+import threading
 
 from . import consolekit as ck
+from . import line_cache
 from . import util
 
 
 
+# constants
+
+_LINES_PER_BLOCK = 256
+_LOOKAHEAD_LINES = _LINES_PER_BLOCK
+_MAX_LINES_PER_ROUND = 16 * _LINES_PER_BLOCK
+_MAX_RELEXED_LINES = 2 * _LINES_PER_BLOCK
+
+
+
 # classes
 
-class _AttrTable:
-  def __init__(self, console, style="default", colorize=True, decorate=True):
+Checkpoint = collections.namedtuple("Checkpoint", ("line_index", "offset"))
+
+
+class _RestartCheckpoints:
+  """
+  Checkpoints at which lexing can restart, which are kept in memory for a
+  source without a line cache as its text is lexed.
+  """
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._checkpoints = []
+
+  def restart_checkpoint(self, line_index):
+    """
+    Return the last checkpoint at or before a line at which lexing can
+    restart, or None if there is no such checkpoint but the beginning.
+    """
+    with self._lock:
+      index = bisect.bisect(self._checkpoints, (line_index + 1,))
+      return None if index == 0 else self._checkpoints[index - 1]
+
+  def add(self, checkpoint):
+    with self._lock:
+      index = bisect.bisect(self._checkpoints, checkpoint)
+      if index == 0 or self._checkpoints[index - 1] != checkpoint:
+        self._checkpoints.insert(index, checkpoint)
+
+
+class AttrTable:
+  """
+  A table of attributes of token types in a style.
+  It can be pickled to be sent to other processes, which have no console.
+  """
+
+  def __init__(self, console, style_name="default", colorize=True,
+               decorate=True):
+    import pygments.styles
+    self.style_name = style_name
+    self.colorize = colorize
+    self.decorate = decorate
     self._token_type_to_attr = {}
-    for token_type, properties in self._style_to_token_properties(style):
+    for token_type, properties in self._style_to_token_properties(
+        pygments.styles.get_style_by_name(style_name)):
       attr = console.decoration_attrs.normal
       if colorize and properties["color"]:
         attr |= console.color_attrs.get_best_match(
@@ -21,51 +76,582 @@ class _AttrTable:
       if decorate and properties["underline"]:
         attr |= console.decoration_attrs.underline
       self._token_type_to_attr[token_type] = attr
+    self._resolved_token_type_to_attr = dict(self._token_type_to_attr)
 
   def __getitem__(self, token_type):
-    while token_type not in self._token_type_to_attr:
-      if token_type == token_type.parent:
+    if token_type in self._resolved_token_type_to_attr:
+      return self._resolved_token_type_to_attr[token_type]
+
+    ancestor = token_type
+    while ancestor not in self._token_type_to_attr:
+      if ancestor == ancestor.parent:
         raise KeyError("Token type, {} is not found in attribute table."
                        .format(token_type))
-      token_type = token_type.parent
-    return self._token_type_to_attr[token_type]
+      ancestor = ancestor.parent
+
+    attr = self._token_type_to_attr[ancestor]
+    self._resolved_token_type_to_attr[token_type] = attr
+    return attr
+
+  def __getstate__(self):
+    # Token types are singletons and sent as their names.
+    state = dict(self.__dict__)
+    state["_token_type_to_attr"] = [
+        (tuple(token_type), attr)
+        for token_type, attr in self._token_type_to_attr.items()]
+    del state["_resolved_token_type_to_attr"]
+    return state
+
+  def __setstate__(self, state):
+    import pygments.token
+    self.__dict__.update(state)
+    self._token_type_to_attr = {
+        functools.reduce(getattr, names, pygments.token.Token) : attr
+        for names, attr in state["_token_type_to_attr"]}
+    self._resolved_token_type_to_attr = dict(self._token_type_to_attr)
+
+  def items(self):
+    return self._token_type_to_attr.items()
 
   @staticmethod
   def _style_to_token_properties(style):
+    import pygments.formatter
     return pygments.formatter.Formatter(style=style).style
 
 
+class _StateTracker:
+  """
+  A lexer which tells where lexing can restart giving the same tokens, that
+  is between tokens where its state is the initial one.
+  State transitions of regular expression lexers are followed by wrapping
+  actions of their rules. Other lexers can restart nowhere unless they are
+  stateless.
+  """
+
+  def __init__(self, lexer):
+    import pygments.lexer
+    import pygments.lexers.special
+    self._is_stateless = isinstance(lexer, pygments.lexers.special.TextLexer)
+    self._is_tracked = isinstance(lexer, pygments.lexer.RegexLexer)
+    self._lexer = lexer
+    if self._is_tracked:
+      # The lexer is copied as it can be used by other threads.
+      self._rules = lexer._tokens
+      self._lexer = copy.copy(lexer)
+      self._lexer._tokens = {
+          state: [self._wrap_rule(state, *rule) for rule in rules]
+          for state, rules in self._rules.items()}
+    self._text = None
+    self._stack = ["root"]
+    self._context = None # of extended lexers
+    self._initial_context_state = None
+    self._match_span = (0, 0) # of the last match of wrapped rules
+    self._token_span = (0, 0)
+    self._token_string = ""
+
+  def tokens(self, text):
+    """
+    Give triples of a position, a token type and a string of tokens of text.
+    """
+    self._text = None
+    self._stack = ["root"]
+    self._context = None
+    self._match_span = (0, 0)
+    position = 0
+    for token_type, string in self._lexer.get_tokens(text):
+      self._token_span = (position, position + len(string))
+      self._token_string = string
+      if string == "\n":
+        self._follow_reset(position)
+      yield position, token_type, string
+      position += len(string)
+
+  def can_restart_at(self, position):
+    """
+    Tell if lexing can restart at a position in or at the end of the last
+    token given.
+    """
+    if not self._is_tracked:
+      return self._is_stateless
+    match_start, match_end = self._match_span
+    if match_start >= position or match_end > position \
+       or self._stack is None \
+       or not (self._token_span[1] == position
+               or self._token_string.isspace()) \
+       or (self._context is not None
+           and _context_state(self._context)
+               != self._initial_context_state):
+      return False
+    return self._stack == ["root"] \
+           or self._settle(self._stack, position) \
+              == self._settle(["root"], position)
+
+  def _wrap_rule(self, state, rexmatch, action, new_state):
+    import pygments.token
+    is_token_type = action is None or action in pygments.token.Token
+    if is_token_type and new_state is None:
+      return rexmatch, action, new_state
+
+    def wrapped_action(lexer, match, context=None):
+      if self._text is None:
+        self._text = match.string
+        if context is not None:
+          self._context = context
+          self._initial_context_state = copy.deepcopy(
+              _context_state(context))
+      if not is_token_type:
+        tokens = list(action(lexer, match) if context is None else
+                      action(lexer, match, context))
+      else:
+        tokens = [] if action is None else \
+                 [(match.start(), action, match.group())]
+        if context is not None:
+          context.pos = match.end()
+      # Actions can give tokens after matches, e.g. ones of here documents.
+      end = max([match.end()] + [position + len(string)
+                                 for position, _, string in tokens])
+      if context is not None:
+        end = max(end, context.pos)
+      self._follow_match(state, match, end, context, new_state)
+      return tokens
+
+    return rexmatch, wrapped_action, new_state
+
+  def _follow_match(self, state, match, end, context, new_state):
+    # Matches in text lexed by actions, e.g. using(this), are ignored.
+    if match.string is not self._text:
+      return
+    self._match_span = (match.start(), end)
+    stack = self._stack if context is None else list(context.stack)
+    if stack is None or (context is None and stack[-1] != state):
+      self._stack = None # Transitions are not followed from here.
+      return
+    self._stack = stack if new_state is None else \
+                  _follow_transition(stack, new_state)
+
+  def _follow_reset(self, position):
+    # Lexers reset their states at a newline character matching no rule.
+    if self._stack is None or self._stack == ["root"] \
+       or self._match_span[1] > position:
+      return
+    if all(rexmatch(self._text, position) is None
+           for rexmatch, _, _ in self._rules[self._stack[-1]]):
+      self._stack = ["root"]
+
+  def _settle(self, stack, position):
+    # Follow transitions of empty matches, e.g. ones of default(state).
+    import pygments.token
+    for _ in range(len(self._rules)):
+      for rexmatch, action, new_state in self._rules[stack[-1]]:
+        match = rexmatch(self._text, position)
+        if match is not None:
+          break
+      else:
+        return stack
+      if match.end() != position or new_state is None \
+         or not (action is None or action in pygments.token.Token):
+        return stack
+      stack = _follow_transition(stack, new_state)
+    return None
+
+
 
 # functions
 
-def text_to_lines(text,
+def text_to_lines(source,
                   console,
                   lexer,
                   style_name="default",
                   colorize=True,
-                  decorate=True):
-  style = pygments.styles.get_style_by_name(style_name)
-  attr_table = _AttrTable(console,
-                          style=style,
-                          colorize=colorize,
-                          decorate=decorate)
-  yield from _tokens_to_lines(lexer.get_tokens(_strip_text(text)), attr_table)
-
-
-def _tokens_to_lines(tokens, attr_table):
-  line = ck.Line()
-  for token_type, string in tokens:
-    for char in string:
-      if char == '\n':
-        yield line
-        line = ck.Line()
-      elif ck.is_printable_char(char):
-        line += ck.Character(char, attr_table[token_type])
+                  decorate=True,
+                  checkpoint=None):
+  """
+  Return an iterator of pairs of a checkpoint and a line of highlighted text
+  read lazily from a source.
+  The text is lexed continuously and a checkpoint is given only with the
+  first line of each chunk of lines, otherwise None.
+  Passing one of them as checkpoint restarts from that line.
+  Attributes are resolved here so that the iterator itself can be consumed
+  in another thread than the one using the console.
+  """
+  return highlight_lines(source,
+                         lexer,
+                         AttrTable(console,
+                                   style_name=style_name,
+                                   colorize=colorize,
+                                   decorate=decorate),
+                         checkpoint=checkpoint)
+
+
+def highlight_lines(source, lexer, attr_table, checkpoint=None):
+  """
+  Do the same as text_to_lines with an attribute table made in advance.
+  """
+  checkpoint = checkpoint or Checkpoint(line_index=0, offset=0)
+
+  cache = _open_cache(source, lexer, attr_table)
+  if cache is None:
+    lines = _highlight_lines_without_cache(source,
+                                           lexer,
+                                           attr_table,
+                                           checkpoint)
+  else:
+    lines = _highlight_lines_with_cache(cache,
+                                        source,
+                                        lexer,
+                                        attr_table,
+                                        checkpoint)
+  return ((checkpoint, line) for checkpoint, line, _ in lines)
+
+
+def chunk_checkpoints(source):
+  """
+  Return an iterator of checkpoints which highlight_lines gives from the
+  beginning of a source, without lexing it.
+  """
+  checkpoint = Checkpoint(line_index=0, offset=0)
+  for checkpoint, _ in _chunk_lines(
+      _strip_lines(_source_lines(source, checkpoint), checkpoint)):
+    if checkpoint is not None:
+      yield checkpoint
+
+
+def _open_cache(source, lexer, attr_table):
+  fingerprint = source.fingerprint()
+  if fingerprint is None:
+    return None
+  return line_cache.open_line_cache(line_cache.make_key(
+      fingerprint,
+      type(lexer).__module__,
+      type(lexer).__name__,
+      sorted(lexer.options.items()),
+      attr_table.style_name,
+      attr_table.colorize,
+      attr_table.decorate,
+      sorted((str(token_type), attr)
+             for token_type, attr in attr_table.items()),
+      _LINES_PER_BLOCK,
+      _LOOKAHEAD_LINES))
+
+
+@functools.lru_cache(maxsize=None)
+def _restart_checkpoints(source, lexer_key):
+  return _RestartCheckpoints()
+
+
+def _highlight_lines_without_cache(source, lexer, attr_table, checkpoint):
+  """
+  Highlight lines from the last checkpoint at which lexing can restart as
+  _highlight_lines_with_cache does, keeping such checkpoints in memory.
+  """
+  restart_checkpoints = _restart_checkpoints(
+      source,
+      line_cache.make_key(type(lexer).__module__,
+                          type(lexer).__name__,
+                          sorted(lexer.options.items())))
+  restart_checkpoint = restart_checkpoints.restart_checkpoint(
+      checkpoint.line_index)
+  restart_checkpoint = Checkpoint(line_index=0, offset=0) \
+                       if restart_checkpoint is None else restart_checkpoint
+  if checkpoint.line_index - restart_checkpoint.line_index \
+     > _MAX_RELEXED_LINES:
+    yield from _highlight_lines(source, lexer, attr_table, checkpoint)
+    return
+
+  chunk_checkpoint = restart_checkpoint
+  for line_checkpoint, line, is_restartable in _highlight_lines(
+      source, lexer, attr_table, restart_checkpoint):
+    if line_checkpoint is not None:
+      chunk_checkpoint = line_checkpoint
+      if is_restartable:
+        restart_checkpoints.add(line_checkpoint)
+    if chunk_checkpoint.line_index >= checkpoint.line_index:
+      yield line_checkpoint, line, is_restartable
+
+
+def _highlight_lines_with_cache(cache,
+                                source,
+                                lexer,
+                                attr_table,
+                                checkpoint):
+  """
+  Read chunks from a cache as long as they are in it and highlight the rest
+  appending them to the cache.
+  Lexing restarts from the last checkpoint at which it can restart. Lines
+  after a jump too far from such a checkpoint are lexed from the jump and
+  not cached.
+  """
+  beginning = Checkpoint(line_index=0, offset=0)
+  chunk_index = 0 if checkpoint == beginning and len(cache) != 0 else \
+                cache.find(checkpoint)
+
+  next_checkpoint = checkpoint
+  if chunk_index is not None:
+    for chunk_checkpoint, lines, next_checkpoint in cache.chunks(chunk_index):
+      for index, line in enumerate(lines):
+        yield (Checkpoint(*chunk_checkpoint) if index == 0 else None), \
+              line, \
+              None
+    if next_checkpoint is None:
+      return
+    next_checkpoint = Checkpoint(*next_checkpoint)
+
+  restart_checkpoint = cache.restart_checkpoint(next_checkpoint.line_index)
+  restart_checkpoint = beginning if restart_checkpoint is None else \
+                       Checkpoint(*restart_checkpoint)
+  if chunk_index is None and next_checkpoint.line_index \
+     - restart_checkpoint.line_index > _MAX_RELEXED_LINES:
+    yield from _highlight_lines(source, lexer, attr_table, checkpoint)
+    return
+
+  # Chunks are appended when the first lines of the next ones are lexed.
+  is_first = restart_checkpoint == beginning
+  chunk_checkpoint = None
+  chunk = []
+  for line_checkpoint, line, is_restartable in _highlight_lines(
+      source, lexer, attr_table, restart_checkpoint):
+    if line_checkpoint is not None:
+      if chunk:
+        cache.append(chunk_checkpoint,
+                     chunk,
+                     next_checkpoint=line_checkpoint,
+                     is_next_restartable=is_restartable,
+                     is_first=is_first)
+        is_first = False
+      chunk_checkpoint, chunk = line_checkpoint, []
+    chunk.append(line)
+    if chunk_checkpoint.line_index >= next_checkpoint.line_index:
+      yield line_checkpoint, line, is_restartable
+
+  if chunk:
+    cache.append(chunk_checkpoint, chunk, is_first=is_first)
+
+
+def _highlight_lines(source, lexer, attr_table, checkpoint):
+  """
+  Give triples of a checkpoint, a highlighted line and if lexing can restart
+  at it, which are None except at the first line of each chunk.
+  Text is lexed continuously, in rounds from the last chunk at which lexing
+  can restart, and lines are given only if _LOOKAHEAD_LINES lines are lexed
+  after them, or if no more line is available for now.
+  """
+  tracker = _StateTracker(lexer)
+  chunks = _chunk_lines(
+      _strip_lines(_source_lines(source, checkpoint), checkpoint))
+  window = [] # chunks from the last one at which lexing can restart
+  number_of_given_lines = 0 # in the window
+  round_size = _LINES_PER_BLOCK
+
+  is_end = False
+  while not is_end:
+    # Rounds grow while lexing cannot restart in them so that lines are
+    # lexed at most about 4/3 times on average.
+    number_of_lines = sum(len(text_lines) for _, text_lines in window)
+    target = number_of_given_lines \
+             + max(round_size, 3 * number_of_given_lines) + _LOOKAHEAD_LINES
+    round_size = min(2 * round_size, _MAX_LINES_PER_ROUND)
+    is_stalled = False
+    while number_of_lines < target and not is_stalled:
+      chunk = next(chunks, None)
+      is_end = chunk is None
+      if is_end:
+        break
+      is_stalled = chunk[1] is None
+      if not is_stalled:
+        window.append(chunk)
+        number_of_lines += len(chunk[1])
+
+    end = number_of_lines if is_end or is_stalled else \
+          number_of_lines - _LOOKAHEAD_LINES
+    if end <= number_of_given_lines:
+      continue
+
+    # Carriage returns are removed as lexers take them as newlines.
+    text = "\n".join(itertools.chain.from_iterable(
+        text_lines for _, text_lines in window)).replace("\r", "") + "\n"
+    chunk_indices = {} # by indices of their first lines in the window
+    line_index = 0
+    for chunk_index, (chunk_checkpoint, text_lines) in enumerate(window):
+      if chunk_checkpoint is not None:
+        chunk_indices[line_index] = chunk_index
+      line_index += len(text_lines)
+
+    restart_index = 0
+    for line_index, (is_restartable, line) in enumerate(itertools.islice(
+        _lex_lines(tracker, text, attr_table, chunk_indices), end)):
+      chunk_checkpoint = None
+      if line_index in chunk_indices:
+        chunk_checkpoint = window[chunk_indices[line_index]][0]
+        if is_restartable:
+          restart_index = chunk_indices[line_index]
+      if line_index >= number_of_given_lines:
+        yield chunk_checkpoint, line, is_restartable
+
+    number_of_given_lines = end - sum(len(text_lines)
+                                      for _, text_lines
+                                      in window[:restart_index])
+    window = window[restart_index:]
+
+
+def _lex_lines(tracker, text, attr_table, line_indices):
+  """
+  Give pairs of if lexing can restart at a line of text and the line
+  highlighted, where the former is None except at the lines of indices.
+  """
+  line_index = 0
+  is_restartable = True if line_index in line_indices else None
+  strings = []
+  attrs = array.array("I")
+  for position, token_type, string in tracker.tokens(text):
+    attr = attr_table[token_type]
+    for index, string in enumerate(string.split("\n")):
+      if index != 0:
+        yield is_restartable, ck.Line.from_string("".join(strings), attrs)
+        position += 1
+        line_index += 1
+        is_restartable = tracker.can_restart_at(position) \
+                         if line_index in line_indices else None
+        strings = []
+        attrs = array.array("I")
+      position += len(string)
+      if not ck.is_printable_string(string):
+        string = "".join(filter(ck.is_printable_char, string))
+      strings.append(string)
+      attrs.extend(array.array("I", [attr]) * len(string))
 
   # if there is no newline character at the end of the last line
-  if len(line) > 0:
-    yield line
+  if len(attrs) > 0:
+    yield is_restartable, ck.Line.from_string("".join(strings), attrs)
+
+
+def _context_state(context):
+  # Extended lexers keep their states in attributes of their contexts.
+  return {name: value for name, value in vars(context).items()
+          if name not in ("text", "pos", "end", "stack") and value}
+
+
+def _follow_transition(stack, new_state):
+  # Do the same as pygments.lexer.RegexLexer.get_tokens_unprocessed does.
+  stack = list(stack)
+  if isinstance(new_state, tuple):
+    for state in new_state:
+      if state == "#pop":
+        if len(stack) > 1:
+          stack.pop()
+      elif state == "#push":
+        stack.append(stack[-1])
+      else:
+        stack.append(state)
+  elif isinstance(new_state, int):
+    if abs(new_state) >= len(stack):
+      del stack[1:]
+    else:
+      del stack[new_state:]
+  elif new_state == "#push":
+    stack.append(stack[-1])
+  return stack
+
+
+def _source_lines(source, checkpoint):
+  """
+  Give checkpoints to lines of a source.
+  None as a line, which means no more line is available for now, is passed
+  through with None as a checkpoint.
+  """
+  line_index = checkpoint.line_index
+  for offset, text_line in source.lines(checkpoint.offset):
+    if text_line is None:
+      yield None, None
+      continue
+    yield Checkpoint(line_index=line_index, offset=offset), text_line
+    line_index += 1
+
+
+def _strip_lines(checkpoints_and_text_lines, checkpoint):
+  """
+  Strip trailing spaces of lines and blank lines at the beginning and the
+  end of text.
+  """
+  blank_lines = []
+  is_beginning = checkpoint.offset == 0
+
+  for checkpoint, text_line in checkpoints_and_text_lines:
+    if text_line is None:
+      yield checkpoint, text_line
+      continue
+    text_line = text_line.rstrip()
+    if text_line == "":
+      if not is_beginning:
+        blank_lines.append((checkpoint, text_line))
+      continue
+    yield from blank_lines
+    blank_lines = []
+    is_beginning = False
+    yield checkpoint, text_line
+
+
+def _chunk_lines(checkpoints_and_text_lines):
+  """
+  Group lines into chunks, at which lexing can restart and lines are cached.
+  Every block of _LINES_PER_BLOCK lines has a chunk starting at its first
+  blank line, or at its first line if it has no blank line.
+  Chunks are decided only by lines in each block so that they do not
+  change wherever lexing restarts from.
+  When no more line is available for now, lines so far are given without
+  waiting for the rest of their chunks or blocks, and then None as lines is.
+  The rest is given later with None as a checkpoint so that only
+  checkpoints of decided chunks are given.
+  """
+  chunk_checkpoint = None # None after the first lines of a chunk are given
+  chunk = []
+  block_index = None
+  is_block_decided = False
+  is_block_given = False # Lines of an undecided block are given partially.
+  block_lines = []
+
+  def start_chunk(checkpoint, text_lines):
+    nonlocal chunk_checkpoint, chunk
+    if chunk:
+      yield chunk_checkpoint, chunk
+    chunk_checkpoint, chunk = checkpoint, text_lines
+
+  def end_block():
+    if is_block_given:
+      chunk.extend(text_line for _, text_line in block_lines)
+    elif block_lines:
+      yield from start_chunk(block_lines[0][0],
+                             [text_line for _, text_line in block_lines])
+
+  for checkpoint, text_line in checkpoints_and_text_lines:
+    if text_line is None:
+      text_lines = chunk + [text_line for _, text_line in block_lines]
+      if text_lines:
+        yield chunk_checkpoint, text_lines
+        chunk_checkpoint, chunk = None, []
+        is_block_given = is_block_given or len(block_lines) != 0
+        block_lines = []
+      yield None, None
+      continue
+
+    if checkpoint.line_index // _LINES_PER_BLOCK != block_index:
+      if block_index is None:
+        chunk_checkpoint = checkpoint
+      yield from end_block()
+      block_index = checkpoint.line_index // _LINES_PER_BLOCK
+      is_block_decided = False
+      is_block_given = False
+      block_lines = []
 
+    if is_block_decided:
+      chunk.append(text_line)
+    elif text_line == "":
+      chunk.extend(text_line for _, text_line in block_lines)
+      yield from start_chunk(checkpoint, [text_line])
+      is_block_decided = True
+      block_lines = []
+    else:
+      block_lines.append((checkpoint, text_line))
 
-def _strip_text(text):
-  return '\n'.join(line.rstrip() for line in text.split('\n'))
+  yield from end_block()
+  if chunk:
+    yield chunk_checkpoint, chunk
@@ -0,0 +1,134 @@
+import http.server
+import os
+import socketserver
+import tempfile
+import threading
+import unittest
+import unittest.mock
+
+from shakyo import http_cache
+
+
+
+# constants
+
+_OLD_BODY = b"".join(b"old line %d\n" % index for index in range(5000))
+_NEW_BODY = b"".join(b"new line %d\n" % index for index in range(5000))
+
+
+
+# classes
+
+class HttpCacheTest(unittest.TestCase):
+  def setUp(self):
+    directory = tempfile.TemporaryDirectory()
+    self.addCleanup(directory.cleanup)
+    patcher = unittest.mock.patch.object(http_cache,
+                                         "_DIRECTORY",
+                                         directory.name)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+    self._server = _Server(("127.0.0.1", 0), _Handler)
+    self.addCleanup(self._server.server_close)
+    self.addCleanup(self._server.shutdown)
+    threading.Thread(target=self._server.serve_forever, daemon=True).start()
+    self._uri = "http://127.0.0.1:{}/example.txt".format(
+        self._server.server_port)
+    self._paths = http_cache._Paths(self._uri)
+
+  def test_resume_a_complete_partial_file(self):
+    self._server.body, self._server.etag = _OLD_BODY, '"1"'
+    self._save_partial_file(_OLD_BODY, '"1"')
+
+    self.assertEqual(_read(http_cache.open_uri(self._uri)), _OLD_BODY)
+    self.assertEqual(self._server.ranges,
+                     ["bytes={}-".format(len(_OLD_BODY))])
+    self.assertEqual(_read_file(self._paths.body), _OLD_BODY)
+
+  def test_resume_a_changed_file(self):
+    self._server.body, self._server.etag = _NEW_BODY, '"2"'
+    self._save_partial_file(_OLD_BODY[:5000], '"1"')
+
+    self.assertEqual(_read(http_cache.open_uri(self._uri)), _NEW_BODY)
+    # The whole body answered to the range request is used as it is.
+    self.assertEqual(self._server.ranges, ["bytes=5000-"])
+    self.assertEqual(_read_file(self._paths.body), _NEW_BODY)
+    self.assertEqual(http_cache._load_metadata(self._paths,
+                                               self._uri)["etag"],
+                     '"2"')
+
+  def _save_partial_file(self, body, etag):
+    os.makedirs(http_cache._DIRECTORY, exist_ok=True)
+    with open(self._paths.part, "wb") as f:
+      f.write(body)
+    http_cache._save_metadata(self._paths, {"uri" : self._uri,
+                                            "etag" : etag,
+                                            "last_modified" : None})
+
+
+class _Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+  daemon_threads = True
+
+  def __init__(self, *args):
+    super().__init__(*args)
+    self.body = b""
+    self.etag = None
+    self.ranges = [] # Range headers of requests
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+  """
+  A handler which gives the body of its server and honors Range only if
+  If-Range has the current ETag.
+  """
+
+  protocol_version = "HTTP/1.1"
+
+  def do_GET(self):
+    body = self.server.body
+    range_header = self.headers.get("Range")
+    self.server.ranges.append(range_header)
+
+    if range_header is None \
+       or self.headers.get("If-Range") != self.server.etag:
+      self.send_response(200)
+    else:
+      start = int(range_header[len("bytes="):-len("-")])
+      if start >= len(body):
+        self.send_response(416)
+        self.send_header("Content-Range", "bytes */{}".format(len(body)))
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+        return
+      self.send_response(206)
+      self.send_header("Content-Range",
+                       "bytes {}-{}/{}".format(start,
+                                               len(body) - 1,
+                                               len(body)))
+      body = body[start:]
+
+    self.send_header("ETag", self.server.etag)
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, *args):
+    pass
+
+
+
+# functions
+
+def _read(example_source):
+  return "\n".join(line for _, line in example_source.lines()) \
+         .encode("UTF-8")
+
+
+def _read_file(path):
+  with open(path, "rb") as f:
+    return f.read()
+
+
+if __name__ == "__main__":
+  unittest.main()
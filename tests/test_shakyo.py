@@ -0,0 +1,74 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock
+
+from shakyo import config
+from shakyo import consolekit as ck
+from shakyo import example_files
+from shakyo import shakyo
+from shakyo import source
+
+
+
+# classes
+
+class ShakyoTest(unittest.TestCase):
+  def setUp(self):
+    directory = tempfile.TemporaryDirectory()
+    self.addCleanup(directory.cleanup)
+    patcher = unittest.mock.patch.object(config,
+                                         "CACHE_DIRECTORY",
+                                         directory.name)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def test_keys_after_the_end_in_a_batch(self):
+    for command_char in [config.GOTO_LINE_CHAR, config.SEARCH_CHAR]:
+      with self.subTest(command_char=command_char):
+        session = _run("a = 1\nb = 2\n",
+                       [config.SCROLL_DOWN_CHAR * 40 + command_char])
+        self.assertIsNone(session.position)
+
+
+class PrefetcherTest(unittest.TestCase):
+  def test_stop_while_waiting_for_a_pipe(self):
+    read_fd, write_fd = os.pipe()
+    self.addCleanup(os.close, write_fd)
+    os.write(write_fd, b"a\n")
+    lines = shakyo._Prefetcher(source.PipeSource(read_fd).lines(), 4)
+    self.assertIn((0, "a"), lines)
+    number_of_threads = threading.active_count()
+
+    start_time = time.perf_counter()
+    lines.stop()
+    self.assertLess(time.perf_counter() - start_time, 0.05)
+    # The thread waiting for the writer ends by itself.
+    end_time = start_time + 1
+    while threading.active_count() == number_of_threads \
+          and time.perf_counter() < end_time:
+      time.sleep(0.01)
+    self.assertLess(threading.active_count(), number_of_threads)
+
+
+
+# functions
+
+def _run(text, keys):
+  with example_files.ExampleFiles(["example.py"],
+                                  [source.TextSource(text)]) as examples, \
+       ck.HeadlessConsole(keys=keys) as console:
+    session = shakyo.Shakyo(console,
+                            examples.example_lines(console,
+                                                   style_name="default",
+                                                   colorize=True,
+                                                   decorate=True),
+                            examples=examples)
+    session.do()
+  return session
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+
+import pygments.lexers
+
+from shakyo import consolekit as ck
+from shakyo import source
+from shakyo import text_to_lines
+
+
+
+# classes
+
+class HighlightLinesTest(unittest.TestCase):
+  def test_rewind_without_cache(self):
+    # Chunks of odd blocks start in docstrings, where lexing cannot restart.
+    text_lines = ["x = 1"] * 2048
+    for block_index in range(1, 8, 2):
+      start = 256 * block_index
+      text_lines[start - 4:start + 8] \
+          = ['"""doc'] + ["doc"] * 4 + [""] + ["doc"] * 5 + ['"""']
+    text = "\n".join(text_lines) + "\n"
+
+    with ck.HeadlessConsole() as console:
+      attr_table = text_to_lines.AttrTable(console)
+    lexer = pygments.lexers.PythonLexer()
+    example_source = _UncachedSource(text)
+    lines = list(text_to_lines.highlight_lines(example_source,
+                                               lexer,
+                                               attr_table))
+    self.assertEqual(len(lines), len(text_lines))
+
+    for checkpoint, _ in lines:
+      if checkpoint is None or checkpoint.line_index <= 512: continue
+      with self.subTest(checkpoint=checkpoint):
+        rewound_lines = text_to_lines.highlight_lines(example_source,
+                                                      lexer,
+                                                      attr_table,
+                                                      checkpoint)
+        for (_, line), (_, rewound_line) in zip(
+            lines[checkpoint.line_index:], rewound_lines):
+          self.assertEqual(str(rewound_line), str(line))
+          self.assertEqual(rewound_line.attrs, line.attrs)
+
+
+class _UncachedSource(source.TextSource):
+  def fingerprint(self):
+    return None
+
+
+if __name__ == "__main__":
+  unittest.main()